@@ -0,0 +1,59 @@
+# a small stand-in for the parts of bpy the add-on touches, data lives in numpy arrays
+from types import SimpleNamespace
+
+from . import props, types
+
+version_string = "fake"
+
+data = SimpleNamespace(
+    meshes=types.IDs(types.Mesh),
+    objects=types.IDs(types.Object),
+    collections=types.IDs(types.Collection),
+)
+
+
+def batch_remove(ids):
+    for id in ids:
+        id.store.remove(id)
+
+
+data.batch_remove = batch_remove
+
+context = SimpleNamespace(
+    scene=types.Scene(types.IDs(types.Collection)),
+    collection=None,
+    view_layer=types.ViewLayer(),
+    evaluated_depsgraph_get=types.Depsgraph,
+)
+
+
+class Timers:
+    def __init__(self) -> None:
+        self.functions = []
+
+    def register(self, function, first_interval: float = 0, persistent: bool = False):
+        self.functions.append(function)
+
+    # blender looks timers up by identity, equal bound methods do not match
+    def unregister(self, function):
+        if not self.is_registered(function):
+            raise ValueError("Error: function is not registered")
+        self.functions = [each for each in self.functions if each is not function]
+
+    def is_registered(self, function) -> bool:
+        return any(each is function for each in self.functions)
+
+
+app = SimpleNamespace(
+    version_string=version_string,
+    timers=Timers(),
+    handlers=SimpleNamespace(
+        depsgraph_update_post=[], persistent=lambda function: function
+    ),
+)
+
+path = SimpleNamespace(abspath=lambda path: path)
+
+utils = SimpleNamespace(
+    register_class=lambda cls: None, unregister_class=lambda cls: None
+)
@@ -0,0 +1,6 @@
+def prop(**kwargs):
+    return kwargs
+
+
+BoolProperty = EnumProperty = FloatProperty = IntProperty = prop
+PointerProperty = StringProperty = prop
@@ -0,0 +1,316 @@
+from numpy import (
+    arange,
+    cross,
+    array,
+    asarray,
+    concatenate,
+    cumsum,
+    diff,
+    empty,
+    eye,
+    float32,
+    int32,
+    repeat,
+    zeros,
+    stack,
+)
+
+
+class ID:
+    def __init__(self, name: str, store: "IDs") -> None:
+        self._name = name
+        self.store = store
+        self.users = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name: str):
+        # blender keeps names unique, the store is keyed by name
+        self._name = self.store.rename(self, name)
+
+    @property
+    def original(self):
+        return self
+
+
+class Elements:
+    def __init__(self, attributes: dict[str, tuple[type, int]]) -> None:
+        self.attributes = attributes
+        self.arrays = {
+            name: empty((0, width), dtype)
+            for name, (dtype, width) in attributes.items()
+        }
+
+    def __len__(self) -> int:
+        return len(next(iter(self.arrays.values())))
+
+    def add(self, count: int):
+        for name, (dtype, width) in self.attributes.items():
+            self.arrays[name] = concatenate(
+                (self.arrays[name], zeros((count, width), dtype))
+            )
+
+    def foreach_get(self, attribute: str, out):
+        out.reshape(-1)[:] = self.arrays[attribute].reshape(-1)
+
+    def foreach_set(self, attribute: str, data):
+        self.arrays[attribute].reshape(-1)[:] = asarray(data).reshape(-1)
+
+    def set(self, attribute: str, data):
+        self.arrays[attribute] = data
+
+
+class Layers(dict):
+    # uv layers and color attributes, none exist unless a script adds them
+    active = None
+    active_color = None
+
+
+class Mesh(ID):
+    def __init__(self, name: str, store: "IDs") -> None:
+        super().__init__(name, store)
+        self.clear_geometry()
+
+    def clear_geometry(self):
+        self.vertices = Elements({"co": (float32, 3)})
+        self.loops = Elements({"vertex_index": (int32, 1)})
+        self.polygons = Elements(
+            {"loop_start": (int32, 1), "material_index": (int32, 1)}
+        )
+        self.loop_triangles = Elements(
+            {"vertices": (int32, 3), "loops": (int32, 3), "material_index": (int32, 1)}
+        )
+        self.uv_layers = Layers()
+        self.color_attributes = Layers()
+
+    def update(self, calc_edges: bool = False):
+        pass
+
+    def validate(self, **kwargs) -> bool:
+        return False
+
+    def calc_loop_triangles(self):
+        # fan triangulation of every polygon
+        corners = self.loops.arrays["vertex_index"].ravel()
+        starts = self.polygons.arrays["loop_start"].ravel()
+        sizes = diff(concatenate((starts, [len(corners)])))
+        counts = sizes - 2
+        polygon = repeat(arange(len(starts)), counts)
+        step = arange(counts.sum()) - repeat(cumsum(counts) - counts, counts)
+        first = starts[polygon]
+        loops = stack((first, first + step + 1, first + step + 2), axis=1)
+        self.loop_triangles.set("vertices", corners[loops].astype(int32))
+        self.loop_triangles.set("loops", loops.astype(int32))
+        materials = self.polygons.arrays["material_index"].ravel()[polygon]
+        self.loop_triangles.set("material_index", materials[:, None])
+
+    @property
+    def corner_normals(self) -> Elements:
+        # flat normal of the first fan triangle of each polygon on all its corners
+        corners = self.loops.arrays["vertex_index"].ravel()
+        starts = self.polygons.arrays["loop_start"].ravel()
+        sizes = diff(concatenate((starts, [len(corners)])))
+        co = self.vertices.arrays["co"]
+        a, b, c = (co[corners[starts + i]] for i in range(3))
+        normals = cross(b - a, c - a)
+        lengths = (normals**2).sum(axis=1, keepdims=True) ** 0.5
+        normals = normals / (lengths + (lengths == 0))
+        elements = Elements({"vector": (float32, 3)})
+        elements.set("vector", repeat(normals, sizes, axis=0).astype(float32))
+        return elements
+
+    def from_pydata(self, vertices, edges, faces):
+        self.clear_geometry()
+        self.vertices.set("co", array(vertices, float32).reshape(-1, 3))
+        sizes = [len(face) for face in faces]
+        self.loops.set(
+            "vertex_index", array([i for face in faces for i in face], int32)[:, None]
+        )
+        starts = cumsum([0, *sizes])[:-1]
+        self.polygons.set("loop_start", starts.astype(int32)[:, None])
+        self.polygons.set("material_index", zeros((len(faces), 1), int32))
+
+    def copy(self) -> "Mesh":
+        mesh = self.store.new(self.name)
+        for elements in ("vertices", "loops", "polygons", "loop_triangles"):
+            for name, data in getattr(self, elements).arrays.items():
+                getattr(mesh, elements).set(name, data.copy())
+        return mesh
+
+
+def compose(location, rotation, scale):
+    w, x, y, z = rotation
+    matrix = eye(4)
+    matrix[:3, :3] = (
+        array(
+            (
+                (1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)),
+                (2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)),
+                (2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)),
+            )
+        )
+        * scale
+    )
+    matrix[:3, 3] = location
+    return matrix
+
+
+class Object(ID):
+    def __init__(self, name: str, store: "IDs", data: ID | None = None) -> None:
+        super().__init__(name, store)
+        self._data = data
+        if data:
+            data.users += 1
+        self.parent: Object | None = None
+        self.users_collection = list[Collection]()
+        self.rotation_mode = "XYZ"
+        self._location = (0.0, 0.0, 0.0)
+        self._rotation = (1.0, 0.0, 0.0, 0.0)
+        self._scale = (1.0, 1.0, 1.0)
+        self.matrix_basis = eye(4)
+
+    @property
+    def type(self) -> str:
+        return "MESH" if self._data else "EMPTY"
+
+    @property
+    def data(self) -> ID | None:
+        return self._data
+
+    @data.setter
+    def data(self, data: ID):
+        if not self._data:
+            raise TypeError("can not assign data to an empty")
+        self._data.users -= 1
+        data.users += 1
+        self._data = data
+
+    def transform(self, location=None, rotation=None, scale=None):
+        self._location = location if location is not None else self._location
+        self._rotation = rotation if rotation is not None else self._rotation
+        self._scale = scale if scale is not None else self._scale
+        self.matrix_basis = compose(self._location, self._rotation, self._scale)
+
+    location = property(
+        lambda self: self._location, lambda self, v: self.transform(location=v)
+    )
+    rotation_quaternion = property(
+        lambda self: self._rotation, lambda self, v: self.transform(rotation=v)
+    )
+    scale = property(lambda self: self._scale, lambda self, v: self.transform(scale=v))
+
+    @property
+    def matrix_world(self):
+        if self.parent:
+            return self.parent.matrix_world @ self.matrix_basis
+        return self.matrix_basis
+
+    @property
+    def children(self) -> list["Object"]:
+        return [obj for obj in self.store.values() if obj.parent is self]
+
+    def evaluated_get(self, depsgraph: "Depsgraph") -> "Object":
+        return self
+
+    def to_mesh(self) -> Mesh:
+        assert isinstance(self._data, Mesh)
+        return self._data
+
+    def to_mesh_clear(self):
+        pass
+
+
+class Links(list):
+    def __init__(self, owner: "Collection") -> None:
+        super().__init__()
+        self.owner = owner
+
+    def link(self, item: ID):
+        self.append(item)
+        if isinstance(item, Object):
+            item.users_collection.append(self.owner)
+
+    def unlink(self, item: ID):
+        self.remove(item)
+        if isinstance(item, Object):
+            item.users_collection.remove(self.owner)
+
+
+class Collection(ID):
+    def __init__(self, name: str, store: "IDs") -> None:
+        super().__init__(name, store)
+        self.objects = Links(self)
+        self.children = Links(self)
+
+
+class IDs(dict):
+    def __init__(self, type: type[ID]) -> None:
+        super().__init__()
+        self.type = type
+
+    def unique(self, name: str) -> str:
+        unique = name
+        suffix = 0
+        while unique in self:
+            suffix += 1
+            unique = f"{name}.{suffix:03d}"
+        return unique
+
+    def new(self, name: str, *args) -> ID:
+        id = self.type(self.unique(name), self, *args)
+        self[id.name] = id
+        return id
+
+    def rename(self, id: ID, name: str) -> str:
+        if self.get(id.name) is id:
+            del self[id.name]
+        name = self.unique(name)
+        self[name] = id
+        return name
+
+    def remove(self, id: ID, do_unlink: bool = True):
+        if self.get(id.name) is not id:
+            return
+        del self[id.name]
+        if isinstance(id, Object):
+            if id._data:
+                id._data.users -= 1
+            for collection in id.users_collection:
+                collection.objects.remove(id)
+
+    def __iter__(self):
+        return iter(list(self.values()))
+
+
+class Depsgraph:
+    def __init__(self) -> None:
+        self.updates = []
+
+
+class ViewLayer:
+    def update(self):
+        pass
+
+
+class Scene:
+    def __init__(self, store: IDs) -> None:
+        self.collection = Collection("Scene Collection", store)
+
+
+class Context:
+    pass
+
+
+class PropertyGroup:
+    pass
+
+
+class Operator:
+    pass
+
+
+class Panel:
+    pass
@@ -0,0 +1,5 @@
+from numpy import array
+
+
+def Matrix(rows):
+    return array(rows, float)
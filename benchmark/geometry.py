@@ -0,0 +1,19 @@
+from numpy import float32, int32, linspace, meshgrid, stack, zeros_like
+
+
+def grid(triangle_count: int):
+    side = max(1, int((triangle_count / 2) ** 0.5))
+    x, y = meshgrid(linspace(0, 1, side + 1), linspace(0, 1, side + 1))
+    positions = stack((x, y, zeros_like(x)), axis=-1).reshape(-1, 3).astype(float32)
+    corners = (
+        (side + 1) * linspace(0, side - 1, side, dtype=int32)[:, None]
+        + linspace(0, side - 1, side, dtype=int32)[None, :]
+    ).ravel()
+    triangles = stack(
+        (
+            stack((corners, corners + 1, corners + side + 2), axis=1),
+            stack((corners, corners + side + 2, corners + side + 1), axis=1),
+        ),
+        axis=1,
+    ).reshape(-1, 3)
+    return positions, triangles
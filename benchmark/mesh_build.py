@@ -0,0 +1,37 @@
+# blender --background --factory-startup --python benchmark/mesh_build.py
+from pathlib import Path
+import sys
+from time import perf_counter
+
+import bpy
+
+sys.path[:0] = [str(Path(__file__).resolve().parent.parent), str(Path(__file__).parent)]
+from blender_server import blender_util  # noqa: E402
+from geometry import grid  # noqa: E402
+
+
+def measure(build) -> float:
+    mesh = bpy.data.meshes.new("benchmark")
+    start = perf_counter()
+    build(mesh)
+    elapsed = perf_counter() - start
+    bpy.data.meshes.remove(mesh)
+    return elapsed
+
+
+def build_from_pydata(mesh: bpy.types.Mesh):
+    mesh.from_pydata(positions, [], triangles)
+    mesh.update()
+
+
+for triangle_count in (10_000, 100_000, 1_000_000):
+    positions, triangles = grid(triangle_count)
+    from_pydata = measure(build_from_pydata)
+    foreach_set = measure(
+        lambda mesh: blender_util.build_triangle_mesh(mesh, positions, triangles)
+    )
+    print(
+        f"{len(triangles)} triangles: from_pydata {from_pydata * 1000:.1f} ms, "
+        f"foreach_set {foreach_set * 1000:.1f} ms, "
+        f"{from_pydata / foreach_set:.1f}x"
+    )
@@ -0,0 +1,368 @@
+# python benchmark/round_trip.py [--output results.json]
+# blender --background --factory-startup --python benchmark/round_trip.py -- [options]
+# drives the real client against the server and commands, with a stand-in bpy
+# when blender is not available
+import argparse
+from collections.abc import Callable
+from concurrent.futures import Future, wait
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep, time
+from typing import Any
+
+from numpy import float32, int32, percentile, zeros
+
+here = Path(__file__).resolve().parent
+sys.path[:0] = [str(here.parent), str(here.parent / "client" / "src"), str(here)]
+try:
+    import bpy
+except ImportError:
+    sys.path.insert(0, str(here / "fake_blender"))
+    import bpy
+
+from blender_server import command, metrics, protocol, server_  # noqa: E402
+from geometry import grid  # noqa: E402
+import software_client  # noqa: E402
+from software_client import Client, RunCommands, SyncMesh, SyncXform  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transport", choices=("tcp", "unix"), default="tcp")
+    parser.add_argument("--port", type=int, default=8920)
+    parser.add_argument("--inline", action="store_true", help="skip shared memory")
+    parser.add_argument("--compression", type=int, default=0)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--count", type=int, default=20, help="meshes per size")
+    parser.add_argument("--burst", type=int, default=1000, help="transforms per burst")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--channels", default="", help="sync channels, e.g. normal")
+    parser.add_argument("--interval", type=float, help="queue drain interval")
+    parser.add_argument("--output", help="json file, stdout when omitted")
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else sys.argv[1:]
+    return parser.parse_args(argv)
+
+
+def latency(samples: list[float]) -> dict[str, float]:
+    if not samples:
+        return {}
+    p50, p95, p99 = percentile(samples, (50, 95, 99)) * 1000
+    return {
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def timed(future: Future[Any], samples: list[float]) -> Future[Any]:
+    start = perf_counter()
+    future.add_done_callback(lambda _: samples.append(perf_counter() - start))
+    return future
+
+
+def finish(futures: list[Future[Any]]):
+    wait(futures)
+    for future in futures:
+        future.result()
+
+
+class Receiver:
+    # counts sync frames as the client network thread runs them
+    def __init__(self) -> None:
+        self.meshes = 0
+        self.expected = 0
+        self.arrived = threading.Event()
+
+    def expect(self, count: int):
+        self.meshes = 0
+        self.expected = count
+        self.arrived.clear()
+
+    def on_mesh(self, *args):
+        self.meshes += 1
+        if self.meshes >= self.expected:
+            self.arrived.set()
+
+
+def bench_create_mesh(
+    client: Client, triangle_count: int, count: int, publish: bool = False
+) -> dict:
+    positions, triangles = grid(triangle_count)
+    file_path = Path(f"create_mesh/{triangle_count}")
+    meshes = [(positions, triangles)] * count
+    if publish:
+        # the producer fills pooled shared memory arrays, nothing is copied on send
+        meshes = [
+            (
+                software_client.allocate_array(client, positions.shape, float32),
+                software_client.allocate_array(client, triangles.shape, int32),
+            )
+            for _ in range(count)
+        ]
+        for shared_positions, shared_triangles in meshes:
+            shared_positions[:] = positions
+            shared_triangles[:] = triangles
+    send = software_client.publish_mesh if publish else software_client.create_mesh
+    samples = list[float]()
+    start = perf_counter()
+    finish(
+        [
+            timed(send(client, *mesh, Path(f"{i}"), file_path, False), samples)
+            for i, mesh in enumerate(meshes)
+        ]
+    )
+    elapsed = perf_counter() - start
+    if publish:
+        for mesh in meshes:
+            for array in mesh:
+                software_client.release_array(client, array)
+    software_client.clear(client, file_path).result()
+    size = (positions.nbytes + triangles.nbytes) * count
+    return {
+        "triangles": len(triangles),
+        "count": count,
+        "seconds": elapsed,
+        "per_second": count / elapsed,
+        "megabytes_per_second": size / elapsed / (1 << 20),
+        "latency": latency(samples),
+    }
+
+
+def bench_set_xform(client: Client, count: int, rounds: int) -> dict:
+    file_path = Path("set_xform")
+    paths = [Path(f"{i}") for i in range(count)]
+    finish(
+        [software_client.create_cube(client, 1.0, path, file_path) for path in paths]
+    )
+    translation = zeros(3, float32)
+    rotation = zeros(4, float32)
+    rotation[0] = 1
+    scale = zeros(3, float32) + 1
+    samples = list[float]()
+    start = perf_counter()
+    for round in range(rounds):
+        translation[2] = round
+        finish(
+            [
+                timed(
+                    software_client.set_xform(
+                        client, translation, rotation, scale, path, file_path, False
+                    ),
+                    samples,
+                )
+                for path in paths
+            ]
+        )
+    elapsed = perf_counter() - start
+    software_client.clear(client, file_path).result()
+    return {
+        "count": count * rounds,
+        "seconds": elapsed,
+        "per_second": count * rounds / elapsed,
+        "latency": latency(samples),
+    }
+
+
+def bench_sync(
+    client: Client,
+    receiver: Receiver,
+    triangle_count: int,
+    count: int,
+    rounds: int,
+    channels: list[str],
+) -> dict:
+    positions, triangles = grid(triangle_count)
+    file_path = Path("sync")
+    finish(
+        [
+            software_client.create_mesh(
+                client, positions, triangles, Path(f"{i}"), file_path, True, False
+            )
+            for i in range(count)
+        ]
+    )
+    if channels:
+        finish(
+            [
+                software_client.sync_channels(client, Path(f"{i}"), file_path, channels)
+                for i in range(count)
+            ]
+        )
+    samples = list[float]()
+    for _ in range(rounds):
+        receiver.expect(count)
+        start = perf_counter()
+        # sync runs on the main thread, like the sync operator or the auto sync timer
+        command.queue.push(command.sync_all)
+        if not receiver.arrived.wait(30):
+            raise TimeoutError(f"{receiver.meshes} of {count} meshes synced")
+        samples.append(perf_counter() - start)
+    software_client.clear(client, file_path).result()
+    return {
+        "triangles": len(triangles),
+        "count": count,
+        "rounds": rounds,
+        "channels": channels,
+        "latency": latency(samples),
+    }
+
+
+def bench_clear(client: Client, count: int, rounds: int) -> dict:
+    file_path = Path("clear")
+    samples = list[float]()
+    for _ in range(rounds):
+        finish(
+            [
+                software_client.create_cube(client, 1.0, Path(f"{i}"), file_path)
+                for i in range(count)
+            ]
+        )
+        finish([timed(software_client.clear(client, file_path), samples)])
+    return {"objects": count, "rounds": rounds, "latency": latency(samples)}
+
+
+def scenario(client: Client, name: str, run: Callable[[], dict]) -> dict:
+    metrics.registry.reset()
+    result = {"name": name, **run()}
+    result["server"] = software_client.stats(client).result()["commands"]
+    return result
+
+
+def run_all(args: argparse.Namespace, client: Client, receiver: Receiver) -> list:
+    deadline = time() + 5
+    while not client.sender:
+        if time() > deadline:
+            raise ConnectionError("client did not connect")
+        sleep(0.01)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = [
+        scenario(
+            client,
+            "create_mesh",
+            lambda: bench_create_mesh(client, size, args.count),
+        )
+        for size in sizes
+    ]
+    results.extend(
+        scenario(
+            client,
+            "publish_mesh",
+            lambda: bench_create_mesh(client, size, args.count, publish=True),
+        )
+        for size in sizes
+    )
+    results.append(
+        scenario(
+            client,
+            "set_xform",
+            lambda: bench_set_xform(client, args.burst, args.rounds),
+        )
+    )
+    results.append(
+        scenario(
+            client,
+            "sync",
+            lambda: bench_sync(
+                client,
+                receiver,
+                sizes[0],
+                args.count,
+                args.rounds,
+                [channel for channel in args.channels.split(",") if channel],
+            ),
+        )
+    )
+    results.append(
+        scenario(client, "clear", lambda: bench_clear(client, args.burst, args.rounds))
+    )
+    return results
+
+
+def serve(run: Callable[[], Any]) -> Any:
+    # blender data is only touched on this thread, the benchmark drives from another
+    result = Future[Any]()
+
+    def drive():
+        try:
+            result.set_result(run())
+        except BaseException as e:
+            result.set_exception(e)
+
+    threading.Thread(target=drive, daemon=True).start()
+    while not result.done():
+        sleep(command.queue.drain())
+    return result.result()
+
+
+def main():
+    args = parse_args()
+    if args.interval is not None:
+        command.queue.interval = args.interval
+    root = bpy.data.collections.new("Server")
+    assert bpy.context.scene
+    bpy.context.scene.collection.children.link(root)
+    command.collection_name = root.name
+
+    socket_path = None
+    if args.transport == "unix":
+        socket_path = os.path.join(tempfile.gettempdir(), "blender_server_bench.sock")
+    server = server_.Server(command.run, command.sync_start, command.sync_end)
+    server.start(args.port, host="127.0.0.1", socket_path=socket_path)
+    sleep(0.2)
+
+    receiver = Receiver()
+    client = Client(lambda data: run_commands.run(data), [], [])
+    run_commands = RunCommands(
+        [
+            SyncMesh(channels_callback=receiver.on_mesh),
+            SyncXform(matrices_callback=lambda *_: None),
+        ],
+        client,
+    )
+    client.prefer_shared_memory = not args.inline
+    client.compression = args.compression
+    client.start(args.port, host="127.0.0.1", socket_path=socket_path)
+    try:
+        results = serve(lambda: run_all(args, client, receiver))
+        shared_memory = client.shared_memory
+        version = client.codec.version
+    finally:
+        client.end()
+        # let the session end on the main thread before the server stops
+        for _ in range(10):
+            command.queue.drain()
+            sleep(0.01)
+        server.end()
+        command.end_sessions()
+
+    report = {
+        "environment": {
+            "blender": bpy.app.version_string,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "transport": args.transport,
+            "shared_memory": shared_memory,
+            "compression": args.compression,
+            "protocol": version,
+            "chunk_size": protocol.chunk_size,
+            "queue_interval": command.queue.interval,
+            "time": time(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+
+main()
@@ -10,15 +10,33 @@ bl_info = {
 
 import atexit
 import importlib
+import logging
+import os
+import socket
+import tempfile
 from typing import get_type_hints
 import bpy
 from bpy.types import Context
 
 from . import blender_util
+from . import buffer_pool
+from . import metrics
+from . import primitive
+from . import protocol
+from . import scheduler
 from . import server_
 from . import command
 
-for submod in (server_, command, blender_util):
+for submod in (
+    buffer_pool,
+    metrics,
+    primitive,
+    protocol,
+    scheduler,
+    server_,
+    command,
+    blender_util,
+):
     importlib.reload(submod)
 
 server: server_.Server | None = None
@@ -34,8 +52,86 @@ atexit.register(unload)
 property_group_idname = "blender_server_property_group"
 
 
+def update_budget(self: "PropertyGroup", context: Context):
+    command.queue.budget_ms = self.budget
+
+
+def update_sync_slice(self: "PropertyGroup", context: Context):
+    command.sync_slice_ms = self.sync_slice
+
+
+def update_auto_sync(self: "PropertyGroup", context: Context):
+    command.auto_sync_interval = 1 / self.sync_rate
+    registered = bpy.app.timers.is_registered(command.auto_sync)
+    if self.auto_sync and not registered:
+        bpy.app.timers.register(command.auto_sync, persistent=True)
+    elif not self.auto_sync and registered:
+        bpy.app.timers.unregister(command.auto_sync)
+
+
+logger = logging.getLogger(__name__)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(
+    logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+)
+
+
+def update_log_level(self: "PropertyGroup", context: Context):
+    logger.setLevel(self.log_level)
+
+
+def update_metrics(self: "PropertyGroup", context: Context):
+    command.metrics_path = bpy.path.abspath(self.metrics_path)
+    command.metrics_interval = self.metrics_interval
+    registered = bpy.app.timers.is_registered(command.export_metrics)
+    if command.metrics_path and not registered:
+        bpy.app.timers.register(command.export_metrics, persistent=True)
+    elif not command.metrics_path and registered:
+        bpy.app.timers.unregister(command.export_metrics)
+
+
+log_levels = [
+    (level, level.lower(), "") for level in ("DEBUG", "INFO", "WARNING", "ERROR")
+]
+
+transports = [("TCP", "TCP", "TCP socket, reachable from other machines")]
+if hasattr(socket, "AF_UNIX"):
+    transports.append(("UNIX", "Unix", "Unix domain socket for local producers"))
+
+
 class PropertyGroup(bpy.types.PropertyGroup):
+    transport: bpy.props.EnumProperty(name="transport", items=transports)
+    host: bpy.props.StringProperty(name="host", description="empty binds all")
     port: bpy.props.IntProperty(name="port", default=8888)
+    socket_path: bpy.props.StringProperty(
+        name="socket path",
+        default=os.path.join(tempfile.gettempdir(), "blender_server.sock"),
+        subtype="FILE_PATH",
+    )
+    budget: bpy.props.FloatProperty(
+        name="budget ms", default=5.0, min=0.1, update=update_budget
+    )
+    auto_sync: bpy.props.BoolProperty(
+        name="auto sync", default=False, update=update_auto_sync
+    )
+    sync_rate: bpy.props.FloatProperty(
+        name="max sync rate", default=30.0, min=0.1, update=update_auto_sync
+    )
+    sync_slice: bpy.props.FloatProperty(
+        name="sync slice ms", default=2.0, min=0.1, update=update_sync_slice
+    )
+    log_level: bpy.props.EnumProperty(
+        name="log level", items=log_levels, default="INFO", update=update_log_level
+    )
+    metrics_path: bpy.props.StringProperty(
+        name="metrics file",
+        description="periodically write stats as json, empty disables it",
+        subtype="FILE_PATH",
+        update=update_metrics,
+    )
+    metrics_interval: bpy.props.FloatProperty(
+        name="metrics interval", default=5.0, min=0.1, update=update_metrics
+    )
 
 
 class StartOperator(bpy.types.Operator):
@@ -44,14 +140,21 @@ class StartOperator(bpy.types.Operator):
 
     def execute(self, context: Context) -> ...:
         assert bpy.context.collection
+        assert server
+        property_group: PropertyGroup = getattr(context.scene, property_group_idname)
+        command.queue.budget_ms = property_group.budget
+        logger.setLevel(property_group.log_level)
+        metrics.registry.reset()
+        # sessions only start once drained, after the collection exists
+        if property_group.transport == "UNIX":
+            server.start(property_group.port, socket_path=property_group.socket_path)
+        else:
+            server.start(property_group.port, host=property_group.host or None)
         collection = bpy.data.collections.new("Server")
         command.collection_name = collection.name
         scene = bpy.context.scene
         assert scene
         scene.collection.children.link(collection)
-        assert server
-        property_group: PropertyGroup = getattr(context.scene, property_group_idname)
-        server.start(property_group.port)
         return {"FINISHED"}
 
 
@@ -62,6 +165,7 @@ class EndOperator(bpy.types.Operator):
     def execute(self, context: Context) -> ...:
         assert server
         server.end()
+        command.end_sessions()
         if command.collection_name:
             collection = bpy.data.collections[command.collection_name]
             bpy.data.collections.remove(collection)
@@ -73,7 +177,16 @@ class SyncOperator(bpy.types.Operator):
     bl_label = "Sync"
 
     def execute(self, context: Context) -> ...:
-        command.sync()
+        command.sync_all()
+        return {"FINISHED"}
+
+
+class CancelSyncOperator(bpy.types.Operator):
+    bl_idname = "blender_server.cancel_sync_operator"
+    bl_label = "Cancel Sync"
+
+    def execute(self, context: Context) -> ...:
+        command.cancel_sync()
         return {"FINISHED"}
 
 
@@ -93,16 +206,63 @@ class Pannel(bpy.types.Panel):
         layout.operator(StartOperator.bl_idname, text="Start")
         layout.operator(EndOperator.bl_idname, text="End")
         layout.operator(SyncOperator.bl_idname, text="Sync")
+        if any(session.job for session in command.sessions.values()):
+            layout.operator(CancelSyncOperator.bl_idname, text="Cancel Sync")
+        queue = command.queue
+        layout.label(text=f"queue: {queue.depth} ({queue.drain_rate:.0f}/s)")
+        snapshot = metrics.registry.snapshot()
+        layout.label(
+            text=f"in {snapshot['bytes_in_rate'] / 1024:.0f} KiB/s, "
+            f"out {snapshot['bytes_out_rate'] / 1024:.0f} KiB/s"
+        )
+        slowest = sorted(
+            snapshot["commands"].items(), key=lambda item: -item[1]["execute_ms"]
+        )
+        for id, stats in slowest[:5]:
+            layout.label(
+                text=f"{id}: {stats['executed']} ({stats['rate']:.0f}/s), "
+                f"decode {stats['decode_ms']:.2f} ms, wait {stats['wait_ms']:.1f} ms, "
+                f"run {stats['execute_ms']:.2f} ms, max {stats['max_execute_ms']:.1f} ms"
+            )
+        for session in list(command.sessions.values()):
+            buffers = session.buffers
+            layout.label(
+                text=f"{session.name}: queue {queue.owner_depth(session.connection)}, "
+                f"buffers {buffers.outstanding >> 10} KiB in use, "
+                f"{buffers.allocated >> 10} KiB pooled, "
+                f"peak {buffers.high_water >> 10} KiB"
+            )
+            sender = session.connection.sender
+            layout.label(
+                text=f"{session.name} send: {sender.depth} frames, "
+                f"{sender.bytes >> 10} KiB, {sender.coalesced} coalesced, "
+                f"{sender.dropped} dropped"
+            )
+            if job := session.job:
+                layout.label(text=f"{session.name} sync: {job.done}/{job.total}")
 
 
-classes = [PropertyGroup, StartOperator, EndOperator, SyncOperator, Pannel]
+classes = [
+    PropertyGroup,
+    StartOperator,
+    EndOperator,
+    SyncOperator,
+    CancelSyncOperator,
+    Pannel,
+]
 
 
 def register():
     global server
     server = server_.Server(command.run, command.sync_start, command.sync_end)
+    if log_handler not in logger.handlers:
+        logger.addHandler(log_handler)
+    logger.setLevel(logging.INFO)
     for cls in classes:
         bpy.utils.register_class(cls)
+    if not bpy.app.timers.is_registered(command.drain):
+        bpy.app.timers.register(command.drain, persistent=True)
+    bpy.app.handlers.depsgraph_update_post.append(command.on_depsgraph_update)
     setattr(
         bpy.types.Scene,
         property_group_idname,
@@ -113,6 +273,17 @@ def register():
 def unregister():
     assert server
     server.end()
+    if bpy.app.timers.is_registered(command.drain):
+        bpy.app.timers.unregister(command.drain)
+    if bpy.app.timers.is_registered(command.auto_sync):
+        bpy.app.timers.unregister(command.auto_sync)
+    if bpy.app.timers.is_registered(command.export_metrics):
+        bpy.app.timers.unregister(command.export_metrics)
+    logger.removeHandler(log_handler)
+    if command.on_depsgraph_update in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(command.on_depsgraph_update)
+    command.queue.clear()
+    command.end_sessions()
     if command.collection_name:
         collection = bpy.data.collections[command.collection_name]
         bpy.data.collections.remove(collection)
@@ -1,43 +1,170 @@
 from pathlib import Path
+from sys import intern
+
+from numpy import arange, ascontiguousarray, float32, int32, ndarray
 import bpy
 
-def create_object_hierarchy_from_path(
-    root: bpy.types.Collection,
-    path: Path,
-    file_path: Path,
-    objects: dict[tuple[Path, Path], str],
-    collections: dict[Path, str],
-) -> bpy.types.Object:
-    parts = path.parts
-
-    if obj_name := objects.get((path, file_path)):
-        return bpy.data.objects[obj_name]
-
-    if len(parts) > 1:
-        parent_path = path.parent
-        parent = create_object_hierarchy_from_path(
-            root, parent_path, file_path, objects, collections
-        )
-    else:
-        parent = None
-
-    name = "/".join(reversed(parts))
-
-    obj = bpy.data.objects.new(name, bpy.data.meshes.new("_"))
-
-    if collection_name := collections.get(file_path):
-        collection = bpy.data.collections[collection_name]
-    else:
-        assert bpy.context.scene
-        collection_name = "/".join(reversed(file_path.parts))
-        collection = bpy.data.collections.new(collection_name)
-        bpy.context.scene.collection.children.link(collection)
-        collections[file_path] = collection.name
-
-    collection.objects.link(obj)
-    objects[(path, file_path)] = obj.name
-
-    if parent:
-        obj.parent = parent
-
-    return obj
+
+def build_mesh(
+    mesh: bpy.types.Mesh,
+    positions: ndarray,
+    corner_vertices: ndarray,
+    loop_starts: ndarray,
+):
+    mesh.clear_geometry()
+    mesh.vertices.add(len(positions))
+    mesh.loops.add(len(corner_vertices))
+    mesh.polygons.add(len(loop_starts))
+    # matching dtypes let foreach_set copy the buffers without per element conversion
+    mesh.vertices.foreach_set("co", ascontiguousarray(positions, float32).ravel())
+    mesh.loops.foreach_set("vertex_index", ascontiguousarray(corner_vertices, int32))
+    # face sizes follow from the loop starts, loop_total is read only since 4.0
+    mesh.polygons.foreach_set("loop_start", ascontiguousarray(loop_starts, int32))
+    mesh.update(calc_edges=True)
+
+
+def build_triangle_mesh(mesh: bpy.types.Mesh, positions: ndarray, triangles: ndarray):
+    build_mesh(
+        mesh,
+        positions,
+        triangles.ravel(),
+        arange(0, triangles.size, 3, dtype=int32),
+    )
+
+
+class PathNode:
+    __slots__ = ("object", "children")
+
+    def __init__(self, obj: bpy.types.Object | None) -> None:
+        self.object = obj
+        self.children = dict[str, PathNode]()
+
+
+class FileNode(PathNode):
+    __slots__ = ("collection",)
+
+    def __init__(self, collection: bpy.types.Collection) -> None:
+        super().__init__(None)
+        self.collection = collection
+
+
+class PathIndex:
+    def __init__(self) -> None:
+        self.root: bpy.types.Collection | None = None
+        self.files = dict[Path, FileNode]()
+        self.nodes = dict[tuple[Path, Path], PathNode]()
+
+    def file(self, file_path: Path) -> FileNode:
+        if file := self.files.get(file_path):
+            return file
+        collection = bpy.data.collections.new("/".join(reversed(file_path.parts)))
+        if self.root:
+            self.root.children.link(collection)
+        else:
+            assert bpy.context.scene
+            bpy.context.scene.collection.children.link(collection)
+        file = self.files[file_path] = FileNode(collection)
+        return file
+
+    def get(self, path: Path, file_path: Path) -> bpy.types.Object | None:
+        if node := self.nodes.get((path, file_path)):
+            return node.object
+        return None
+
+    def resolve(
+        self,
+        path: Path,
+        file_path: Path,
+        data: bpy.types.ID | None = None,
+    ) -> bpy.types.Object:
+        key = (path, file_path)
+        node = self.nodes.get(key)
+        if not node:
+            node = self.create(path, file_path, data)
+        elif data is not None:
+            self.assign(node, data)
+        assert node.object
+        return node.object
+
+    def create(
+        self, path: Path, file_path: Path, data: bpy.types.ID | None
+    ) -> PathNode:
+        file = self.file(file_path)
+        parts = path.parts
+        node: PathNode = file
+        name = ""
+        # walk down once, creating every missing ancestor as an empty
+        for depth, part in enumerate(parts):
+            part = intern(part)
+            name = f"{part}/{name}" if name else part
+            child = node.children.get(part)
+            if not child:
+                leaf = depth == len(parts) - 1
+                obj = bpy.data.objects.new(name, data if leaf else None)
+                file.collection.objects.link(obj)
+                if node.object:
+                    obj.parent = node.object
+                child = node.children[part] = PathNode(obj)
+                self.nodes[(Path(*parts[: depth + 1]), file_path)] = child
+            node = child
+        return node
+
+    def assign(self, node: PathNode, data: bpy.types.ID):
+        obj = node.object
+        assert obj
+        if obj.type != "EMPTY":
+            obj.data = data
+            return
+        # the object type is fixed at creation, so swap the empty for a new object
+        name = obj.name
+        obj.name = f"{name}.replaced"
+        replacement = bpy.data.objects.new(name, data)
+        for collection in obj.users_collection:
+            collection.objects.link(replacement)
+        replacement.parent = obj.parent
+        replacement.rotation_mode = obj.rotation_mode
+        replacement.matrix_basis = obj.matrix_basis.copy()
+        for child in obj.children:
+            child.parent = replacement
+        bpy.data.objects.remove(obj, do_unlink=True)
+        node.object = replacement
+
+    def remove(
+        self, path: Path | None, file_path: Path
+    ) -> tuple[list[bpy.types.Object], bpy.types.Collection | None]:
+        if not (file := self.files.get(file_path)):
+            return [], None
+        collection = None
+        root: PathNode | None = file
+        if path is None:
+            del self.files[file_path]
+            collection = file.collection
+            path = Path()
+        else:
+            for part in path.parts[:-1]:
+                if not (root := root.children.get(part)):
+                    return [], None
+            if not (root := root.children.pop(path.name, None)):
+                return [], None
+
+        objects = list[bpy.types.Object]()
+        stack = [(root, path)]
+        while stack:
+            node, node_path = stack.pop()
+            if node.object:
+                objects.append(node.object)
+                del self.nodes[(node_path, file_path)]
+            stack.extend(
+                (child, node_path / part) for part, child in node.children.items()
+            )
+        return objects, collection
+
+    def objects(self) -> list[bpy.types.Object]:
+        return [node.object for node in self.nodes.values() if node.object]
+
+    def collections(self) -> list[bpy.types.Collection]:
+        return [file.collection for file in self.files.values()]
+
+    def clear(self):
+        self.files.clear()
+        self.nodes.clear()
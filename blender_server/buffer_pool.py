@@ -0,0 +1,113 @@
+from dataclasses import dataclass
+from itertools import count
+from multiprocessing.shared_memory import SharedMemory
+import threading
+
+
+def size_class(size: int, min_size: int) -> int:
+    return max(min_size, 1 << (size - 1).bit_length())
+
+
+@dataclass
+class Segment:
+    shared: SharedMemory
+    size: int
+    generation: int
+    # frames still referencing the segment, it returns to the pool at zero
+    refs: int = 1
+
+
+class BufferPool:
+    def __init__(
+        self, prefix: str, min_size: int = 4096, free_limit: int = 256 << 20
+    ) -> None:
+        # every segment name starts with the owner prefix
+        self.prefix = prefix
+        self.ids = count(1)
+        self.min_size = min_size
+        self.free_limit = free_limit
+        self.free = dict[int, list[SharedMemory]]()
+        self.free_bytes = 0
+        self.used = dict[str, Segment]()
+        self.generation = 0
+        self.allocated = 0
+        self.high_water = 0
+        # the sync worker acquires while the main thread releases acked segments
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def next_generation(self) -> int:
+        self.generation += 1
+        return self.generation
+
+    def acquire(self, size: int, generation: int | None = None) -> SharedMemory:
+        size = size_class(size, self.min_size)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError(f"buffer pool {self.prefix} is closed")
+            if free := self.free.get(size):
+                shared = free.pop()
+                self.free_bytes -= size
+            else:
+                name = f"{self.prefix}{next(self.ids)}"
+                shared = SharedMemory(name=name, create=True, size=size)
+                self.allocated += size
+                self.high_water = max(self.high_water, self.allocated)
+            if generation is None:
+                generation = self.generation
+            self.used[shared.name] = Segment(shared, size, generation)
+        return shared
+
+    def retain(self, name: str):
+        with self.lock:
+            if segment := self.used.get(name):
+                segment.refs += 1
+
+    def release(self, name: str, generation: int | None = None):
+        with self.lock:
+            segment = self.used.get(name)
+            if not segment:
+                return
+            # an ack from an older generation must not free a buffer that was reused
+            if generation is not None and generation != segment.generation:
+                return
+            segment.refs -= 1
+            if segment.refs > 0:
+                return
+            del self.used[name]
+            if self.free_bytes + segment.size > self.free_limit:
+                self.unlink(segment.shared)
+                self.allocated -= segment.size
+                return
+            self.free.setdefault(segment.size, []).append(segment.shared)
+            self.free_bytes += segment.size
+
+    @property
+    def outstanding(self) -> int:
+        with self.lock:
+            return sum(segment.size for segment in self.used.values())
+
+    @staticmethod
+    def unlink(shared: SharedMemory):
+        try:
+            shared.close()
+        except BufferError:
+            # a view is still alive, the mapping goes away with it
+            pass
+        try:
+            shared.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        with self.lock:
+            for segment in self.used.values():
+                self.unlink(segment.shared)
+            for free in self.free.values():
+                for shared in free:
+                    self.unlink(shared)
+            self.used.clear()
+            self.free.clear()
+            self.free_bytes = 0
+            self.allocated = 0
+            self.closed = True
@@ -1,27 +1,72 @@
 from asyncio import StreamWriter
+from collections import Counter, OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from dataclasses import dataclass
-from math import pi
+from itertools import count
+import json
+import logging
 from multiprocessing.shared_memory import SharedMemory
 from os import unlink
 from pathlib import Path
+from time import perf_counter
 from typing import Any
+from zlib import crc32
 
-from numpy import float32, int32, ndarray, array
+from numpy import (
+    asarray,
+    ascontiguousarray,
+    concatenate,
+    copyto,
+    diff,
+    empty,
+    flatnonzero,
+    float32,
+    identity,
+    int32,
+    ndarray,
+    stack,
+)
 import bpy
-import bmesh
 from mathutils import Matrix
 
 from .server_ import Connection
 
 from . import blender_util
+from . import buffer_pool
+from . import metrics
+from . import primitive
+from . import protocol
+from . import scheduler
+
+logger = logging.getLogger(__name__)
 
 collection_name: str | None = None
+queue = scheduler.CommandQueue()
+# timers match the exact object, a bound method is new on every attribute access
+drain = queue.drain
 
 
 @dataclass
 class SyncedMesh:
     obj_name: str
     sync: bool
+    topology: tuple[int, int, int] | None = None
+    positions: ndarray | None = None
+    source_topology: int | None = None
+    hash: str | None = None
+    # optional attribute channels sent along with every sync frame
+    channels: tuple[str, ...] = ()
+
+
+@dataclass
+class ExtractedMesh:
+    positions: ndarray
+    indices: ndarray
+    # loop of every triangle corner, corner channels are gathered through it
+    corners: ndarray | None
+    channels: dict[str, tuple[ndarray, str]]
 
 
 @dataclass
@@ -30,93 +75,610 @@ class SyncedXform:
     sync: bool
 
 
-class Synced:
-    def __init__(self, connection: Connection) -> None:
+@dataclass
+class SyncedInstances:
+    mesh: bpy.types.Mesh
+    objects: list[bpy.types.Object]
+
+
+class Session:
+    def __init__(self, connection: Connection, id: int) -> None:
         self.connection = connection
+        self.name = f"Session {id}"
+        self.collection_name: str | None = None
         self.meshes = dict[tuple[Path, Path], SyncedMesh]()
         self.xforms = dict[tuple[Path, Path], SyncedXform]()
-        self.buffers = dict[str, SharedMemory]()
-        self.objects = dict[tuple[Path, Path], str]()
-        self.collections = dict[Path, str]()
+        self.buffers = buffer_pool.BufferPool(protocol.segment_prefix(f"s{id}"))
+        # peer segments mapped by the running command, acked once it returns
+        self.opened = list[SharedMemory]()
+        self.index = blender_util.PathIndex()
+        self.object_paths = dict[str, tuple[Path, Path]]()
+        # stable slot of every synced transform in the packed matrix stream
+        self.xform_slots = dict[tuple[Path, Path], int]()
+        self.xform_slots_version = 0
+        self.sent_slots_version = 0
+        self.mesh_cache = OrderedDict[str, tuple[str, int]]()
+        self.instances = dict[tuple[Path, Path], SyncedInstances]()
+        self.mesh_cache_bytes = 0
+        self.dirty_meshes = set[tuple[Path, Path]]()
+        self.dirty_xforms = set[tuple[Path, Path]]()
+        self.job: SyncJob | None = None
+        # worker tasks that may still acquire from the buffers
+        self.packing = list[Future[None]]()
+
+
+sessions = dict[Connection, Session]()
+session_ids = count(1)
+# the session whose command or sync is running on the main thread
+session: Session | None = None
+auto_sync_interval = 1 / 30
+mesh_cache_limit = 1 << 30
+# largest fraction of moved vertices still sent as a sparse delta, 0 disables deltas
+sync_delta_threshold = 0.25
 
 
-synced: Synced | None = None
+@contextmanager
+def use_session(active: Session):
+    global session
+    previous, session = session, active
+    try:
+        yield active
+    finally:
+        session = previous
 
 
 def sync_start(connection: Connection):
-    global synced
-    synced = Synced(connection)
+    # called on the network thread, blender data is only touched once drained
+    queue.push(lambda: start_session(connection), connection)
+
+
+def sync_end(connection: Connection):
+    queue.push(lambda: end_session(connection), connection)
 
 
-def sync_end():
-    global synced
-    clear()
-    synced = None
+def start_session(connection: Connection):
+    active = sessions[connection] = Session(connection, next(session_ids))
+    collection = bpy.data.collections.new(active.name)
+    if collection_name and (root := bpy.data.collections.get(collection_name)):
+        root.children.link(collection)
+    else:
+        assert bpy.context.scene
+        bpy.context.scene.collection.children.link(collection)
+    active.collection_name = collection.name
+    active.index.root = collection
+
+
+def end_session(connection: Connection):
+    if not (active := sessions.pop(connection, None)):
+        return
+    if active.job:
+        active.job.cancel()
+    # packing still in flight, also of finished jobs, writes into the session buffers
+    wait(active.packing, timeout=5)
+    with use_session(active):
+        clear()
+        close_opened()
+    active.buffers.close()
+    if active.collection_name and (
+        collection := bpy.data.collections.get(active.collection_name)
+    ):
+        bpy.data.collections.remove(collection)
 
 
-def sync():
-    assert synced
-    depsgraph = bpy.context.evaluated_depsgraph_get()
-    for path, synced_mesh in synced.meshes.items():
-        if not synced_mesh.sync:
+def end_sessions():
+    for connection in list(sessions):
+        end_session(connection)
+
+
+@bpy.app.handlers.persistent
+def on_depsgraph_update(scene: bpy.types.Scene, depsgraph: bpy.types.Depsgraph):
+    if not sessions:
+        return
+    for update in depsgraph.updates:
+        if not isinstance(update.id, bpy.types.Object):
             continue
-        mesh = bpy.data.objects[synced_mesh.obj_name].evaluated_get(depsgraph).to_mesh()
-        mesh.calc_loop_triangles()
+        name = update.id.original.name
+        for each in sessions.values():
+            path = each.object_paths.get(name)
+            if not path:
+                continue
+            if update.is_updated_geometry and path in each.meshes:
+                each.dirty_meshes.add(path)
+            if update.is_updated_transform and path in each.xforms:
+                each.dirty_xforms.add(path)
+            break
 
-        positions_shared = create_buffer(size=len(mesh.vertices) * 3 * 4)
-        indices_shared = create_buffer(size=len(mesh.loop_triangles) * 3 * 4)
 
-        positions = ndarray(
-            shape=len(mesh.vertices) * 3,
-            dtype=float32,
-            buffer=positions_shared.buf,
-        )
+def auto_sync() -> float:
+    for each in list(sessions.values()):
+        # a peer that is not reading gets no new frames, dirty paths wait for it
+        if each.connection.sender.congested:
+            continue
+        if each.dirty_meshes or each.dirty_xforms:
+            with use_session(each):
+                sync(only_dirty=True)
+    return auto_sync_interval
+
+
+def sync_all():
+    for each in list(sessions.values()):
+        with use_session(each):
+            sync()
+
 
-        indices = ndarray(
-            shape=len(mesh.loop_triangles) * 3, dtype=int32, buffer=indices_shared.buf
+def sync(only_dirty: bool = False):
+    # queues the work, the session's sync job runs it a slice at a time
+    assert session
+    if only_dirty:
+        meshes = list(session.dirty_meshes)
+        xforms = any(path in session.xform_slots for path in session.dirty_xforms)
+    else:
+        meshes = list(session.meshes)
+        xforms = True
+    session.dirty_meshes = set()
+    session.dirty_xforms = set()
+
+    job = session.job
+    if not job:
+        job = session.job = SyncJob(session, session.buffers.next_generation())
+        queue.push(lambda: run_job(job), session.connection)
+    job.add(meshes, not only_dirty, xforms and bool(session.xform_slots))
+
+
+def cancel_sync():
+    for each in list(sessions.values()):
+        if each.job:
+            each.job.cancel()
+
+
+# main thread time one sync slice may take before it yields to commands and the ui
+sync_slice_ms = 2.0
+# triangulation packing, deltas and shared memory copies run here, in order
+worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sync")
+
+
+class SyncJob:
+    def __init__(self, active: Session, generation: int) -> None:
+        self.session = active
+        self.generation = generation
+        # mesh path to whether it needs a full frame
+        self.pending = OrderedDict[tuple[Path, Path], bool]()
+        self.xforms = False
+        self.matrices: ndarray | None = None
+        self.shared: SharedMemory | None = None
+        self.slot = 0
+        self.slots_version = 0
+        self.total = 0
+        self.done = 0
+        self.cancelled = False
+
+    def add(self, meshes: list[tuple[Path, Path]], full: bool, xforms: bool):
+        for path in meshes:
+            if path not in self.pending:
+                self.total += 1
+            self.pending[path] = self.pending.get(path, False) or full
+        self.xforms = self.xforms or xforms
+
+    def cancel(self):
+        self.cancelled = True
+        self.pending.clear()
+        self.xforms = False
+        self.cancel_xforms()
+
+    def submit(self, func: Callable[..., None], *args: Any):
+        future = worker.submit(func, *args)
+        future.add_done_callback(log_failure)
+        active = self.session
+        active.packing = [each for each in active.packing if not each.done()]
+        active.packing.append(future)
+
+    def step(self, deadline: float) -> bool:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        meshes = list[tuple[tuple[Path, Path], SyncedMesh, ExtractedMesh, bool]]()
+        while self.pending and perf_counter() < deadline:
+            path, full = self.pending.popitem(last=False)
+            self.done += 1
+            synced_mesh = self.session.meshes.get(path)
+            if not synced_mesh or not synced_mesh.sync:
+                continue
+            if obj := bpy.data.objects.get(synced_mesh.obj_name):
+                extracted = extract_mesh(obj, depsgraph, synced_mesh.channels)
+                meshes.append((path, synced_mesh, extracted, full))
+        if meshes:
+            self.submit(pack_meshes, self.session, meshes, self.generation)
+        if self.pending:
+            return False
+        if self.xforms:
+            return self.step_xforms(depsgraph, deadline)
+        return True
+
+    def step_xforms(self, depsgraph: bpy.types.Depsgraph, deadline: float) -> bool:
+        active = self.session
+        if (
+            self.matrices is not None
+            and self.slots_version != active.xform_slots_version
+        ):
+            # transforms were added or removed in between, start over
+            self.cancel_xforms()
+        if self.matrices is None:
+            length = len(active.xform_slots)
+            if active.connection.shared_memory:
+                self.shared = create_buffer(length * 16 * 4, active, self.generation)
+                self.matrices = ndarray((length, 4, 4), float32, self.shared.buf)
+            else:
+                self.matrices = empty((length, 4, 4), float32)
+            self.slots_version = active.xform_slots_version
+            self.slot = 0
+        keys = list(active.xform_slots)
+        objects = bpy.data.objects
+        while self.slot < len(keys) and perf_counter() < deadline:
+            synced = active.xforms[keys[self.slot]]
+            # objects deleted in the ui keep their slot until the peer drops the path
+            if obj := objects.get(synced.obj_name):
+                self.matrices[self.slot] = obj.evaluated_get(depsgraph).matrix_world
+            else:
+                self.matrices[self.slot] = identity(4)
+            self.slot += 1
+        if self.slot < len(keys):
+            return False
+
+        paths = None
+        # the slot table only travels when it changed since the last frame
+        if active.sent_slots_version != active.xform_slots_version:
+            paths = [
+                (path.as_posix(), file_path.as_posix()) for path, file_path in keys
+            ]
+            active.sent_slots_version = active.xform_slots_version
+        if self.shared:
+            name, matrices = self.shared.name, None
+        else:
+            name, matrices = "", self.matrices
+        self.submit(
+            send_xforms,
+            active,
+            name,
+            matrices,
+            len(keys),
+            self.generation,
+            self.slots_version,
+            paths,
         )
+        self.matrices = self.shared = None
+        self.xforms = False
+        return True
 
-        mesh.vertices.foreach_get("co", positions)
+    def cancel_xforms(self):
+        if self.shared:
+            self.session.buffers.release(self.shared.name)
+        self.shared = self.matrices = None
+
+
+def run_job(job: SyncJob):
+    active = job.session
+    if job.cancelled or sessions.get(active.connection) is not active:
+        return
+    with use_session(active):
+        try:
+            done = job.step(perf_counter() + sync_slice_ms / 1000)
+        except Exception:
+            # a dead job would swallow every later sync of the session
+            logger.exception("sync failed")
+            job.cancel()
+            active.job = None
+            return
+    if done:
+        active.job = None
+    else:
+        # back of the session queue, commands of every session run in between
+        queue.push(lambda: run_job(job), active.connection)
+
+
+def log_failure(future: Future[None]):
+    if error := future.exception():
+        logger.error("sync failed", exc_info=error)
+
+
+def extract_mesh(
+    obj: bpy.types.Object,
+    depsgraph: bpy.types.Depsgraph,
+    channels: tuple[str, ...] = (),
+) -> ExtractedMesh:
+    evaluated = obj.evaluated_get(depsgraph)
+    mesh = evaluated.to_mesh()
+    try:
+        mesh.calc_loop_triangles()
+        positions = empty((len(mesh.vertices), 3), float32)
+        indices = empty(len(mesh.loop_triangles) * 3, int32)
+        mesh.vertices.foreach_get("co", positions.ravel())
         mesh.loop_triangles.foreach_get("vertices", indices)
+        extracted = ExtractedMesh(positions, indices, None, {})
+        for name in channels:
+            if (channel := extract_channel(mesh, name)) is None:
+                logger.debug("%s has no %s channel", obj.name, name)
+                continue
+            extracted.channels[name] = channel
+        if any(domain == "corner" for _, domain in extracted.channels.values()):
+            extracted.corners = empty(len(indices), int32)
+            mesh.loop_triangles.foreach_get("loops", extracted.corners)
+    finally:
+        # the evaluated copy stays allocated until it is cleared
+        evaluated.to_mesh_clear()
+    return extracted
 
-        synced.connection.send(
-            {
-                "id": "sync_mesh",
-                "params": {
-                    "positions_name": positions_shared.name,
-                    "indices_name": indices_shared.name,
-                    "vertices_length": len(mesh.vertices),
-                    "indices_length": len(mesh.loop_triangles) * 3,
-                    "path": path[0].as_posix(),
-                    "file_path": path[1].as_posix(),
-                },
-            }
+
+channel_kinds = ("normal", "uv", "color", "material")
+
+
+def extract_channel(mesh: bpy.types.Mesh, name: str) -> tuple[ndarray, str] | None:
+    # raw per loop, per point or per triangle data, gathering happens on the worker
+    kind, _, layer = name.partition(":")
+    match kind:
+        case "normal":
+            if hasattr(mesh, "corner_normals"):
+                normals = mesh.corner_normals
+                data = empty((len(normals), 3), float32)
+                normals.foreach_get("vector", data.ravel())
+            else:
+                # before 4.1 split normals live on the loops
+                mesh.calc_normals_split()
+                data = empty((len(mesh.loops), 3), float32)
+                mesh.loops.foreach_get("normal", data.ravel())
+            return data, "corner"
+        case "uv":
+            uv = mesh.uv_layers.get(layer) if layer else mesh.uv_layers.active
+            if not uv:
+                return None
+            data = empty((len(uv.data), 2), float32)
+            uv.data.foreach_get("uv", data.ravel())
+            return data, "corner"
+        case "color":
+            attributes = mesh.color_attributes
+            color = attributes.get(layer) if layer else attributes.active_color
+            if not color:
+                return None
+            data = empty((len(color.data), 4), float32)
+            color.data.foreach_get("color", data.ravel())
+            return data, "corner" if color.domain == "CORNER" else "point"
+        case "material":
+            data = empty(len(mesh.loop_triangles), int32)
+            mesh.loop_triangles.foreach_get("material_index", data)
+            return data, "triangle"
+    return None
+
+
+def send_xforms(
+    active: Session,
+    name: str,
+    matrices: ndarray | None,
+    length: int,
+    generation: int,
+    slots_version: int,
+    paths: list[tuple[str, str]] | None,
+):
+    connection = active.connection
+    if matrices is not None:
+        name = connection.send_buffer(matrices.data)
+    params: dict[str, Any] = {
+        "name": name,
+        "generation": generation,
+        "length": length,
+        "slots_version": slots_version,
+        "paths": paths,
+    }
+    if name.startswith("inline/") or paths is not None:
+        # the slot table must reach the client, and inline chunks are already queued
+        connection.send({"id": "sync_xforms", "params": params})
+        return
+    buffers = active.buffers
+    connection.send(
+        {"id": "sync_xforms", "params": params},
+        key="sync_xforms",
+        supersedes=True,
+        droppable=True,
+        on_drop=lambda: buffers.release(name, generation),
+    )
+
+
+def track_xform(path: Path, file_path: Path, obj: bpy.types.Object, sync: bool):
+    assert session
+    key = (path, file_path)
+    session.xforms[key] = SyncedXform(obj.name, sync)
+    session.object_paths[obj.name] = key
+    if sync and key not in session.xform_slots:
+        session.xform_slots[key] = len(session.xform_slots)
+        session.xform_slots_version += 1
+    elif not sync and key in session.xform_slots:
+        del session.xform_slots[key]
+        session.xform_slots = dict(
+            (key, slot) for slot, key in enumerate(session.xform_slots)
         )
+        session.xform_slots_version += 1
+
 
-    for path, synced_xform in synced.xforms.items():
-        if not synced_xform.sync:
+def resolve_object(
+    path: Path, file_path: Path, data: bpy.types.ID | None = None
+) -> bpy.types.Object:
+    assert session
+    previous = None
+    if data is not None and (obj := session.index.get(path, file_path)):
+        previous = obj.data
+    obj = session.index.resolve(path, file_path, data)
+    if isinstance(previous, bpy.types.Mesh) and previous is not data:
+        remove_unused_mesh(previous)
+    return obj
+
+
+def remove_unused_mesh(mesh: bpy.types.Mesh):
+    assert session
+    # a replaced mesh would stay as an orphan that clear never sees again
+    if mesh.users or any(name == mesh.name for name, _ in session.mesh_cache.values()):
+        return
+    bpy.data.meshes.remove(mesh)
+
+
+def share_array(
+    array: ndarray, active: Session | None = None, generation: int | None = None
+) -> str:
+    active = active or session
+    assert active
+    if not active.connection.shared_memory:
+        return active.connection.send_buffer(ascontiguousarray(array).data)
+    # the worker packs a sync frame after later syncs may have advanced the generation
+    shared = active.buffers.acquire(array.nbytes, generation)
+    copyto(ndarray(array.shape, array.dtype, shared.buf), array)
+    return shared.name
+
+
+def open_buffer(name: str) -> SharedMemory | protocol.InlineBuffer:
+    assert session
+    if inline := session.connection.inline.pop(name):
+        return inline
+    shared = protocol.attach(name)
+    session.opened.append(shared)
+    return shared
+
+
+def close_opened():
+    assert session
+    opened, session.opened = session.opened, []
+    for shared in opened:
+        try:
+            shared.close()
+        except BufferError:
+            logger.warning("buffer %s is still in use", shared.name)
+
+
+def release_params(params: Any, connection: Connection):
+    # every buffer a command names is acked once it ran, used or not,
+    # the peer unlinks its segment after the ack
+    if not isinstance(params, dict):
+        return
+    for key, name in params.items():
+        if not key.endswith("_name") or not name:
             continue
-        obj = bpy.data.objects[synced_xform.obj_name]
-        obj = obj.evaluated_get(depsgraph)
-
-        rotation = (
-            obj.rotation_quaternion[1],
-            obj.rotation_quaternion[2],
-            obj.rotation_quaternion[3],
-            obj.rotation_quaternion[0],
-        )
-        synced.connection.send(
-            {
-                "id": "sync_xform",
-                "params": {
-                    "translation": obj.location.to_tuple(),
-                    "rotation": rotation,
-                    "scale": obj.scale.to_tuple(),
-                    "path": path[0].as_posix(),
-                    "file_path": path[1].as_posix(),
-                },
-            }
-        )
+        if name.startswith("inline/"):
+            connection.inline.pop(name)
+        else:
+            receive_buffer(name, connection)
+
+
+def pack_meshes(
+    active: Session,
+    meshes: list[tuple[tuple[Path, Path], SyncedMesh, ExtractedMesh, bool]],
+    generation: int,
+):
+    # runs on the sync worker, it must not touch bpy
+    for path, synced_mesh, extracted, full in meshes:
+        pack_mesh(active, path, synced_mesh, extracted, generation, full)
+
+
+def pack_mesh(
+    active: Session,
+    path: tuple[Path, Path],
+    synced_mesh: SyncedMesh,
+    extracted: ExtractedMesh,
+    generation: int,
+    full: bool,
+):
+    positions = extracted.positions
+    indices = extracted.indices
+    vertices_length = len(positions)
+    indices_length = len(indices)
+    topology = (vertices_length, indices_length, crc32(indices))
+    params: dict[str, Any] = {
+        "indices_name": "",
+        "ranges_name": "",
+        "ranges_length": 0,
+        "vertices_length": vertices_length,
+        "indices_length": indices_length,
+        "topology": topology[2],
+        "generation": generation,
+        "path": path[0].as_posix(),
+        "file_path": path[1].as_posix(),
+    }
+    previous = synced_mesh.positions
+    if full or topology != synced_mesh.topology:
+        params["indices_name"] = share_array(indices, active, generation)
+        params["positions_name"] = share_array(positions, active, generation)
+    elif previous is not None and sync_delta_threshold > 0:
+        # same topology, ship only the vertex ranges that moved
+        changed = flatnonzero((positions != previous).any(axis=1))
+        if not len(changed) and not extracted.channels:
+            return
+        # channels may change without any vertex moving, they need a whole frame
+        if not len(changed) or len(changed) > sync_delta_threshold * vertices_length:
+            params["positions_name"] = share_array(positions, active, generation)
+        else:
+            breaks = flatnonzero(diff(changed) != 1) + 1
+            starts = changed[concatenate(([0], breaks))]
+            ends = changed[concatenate((breaks - 1, [len(changed) - 1]))] + 1
+            ranges = stack((starts, ends), axis=1).astype(int32)
+            params["ranges_name"] = share_array(ranges, active, generation)
+            params["ranges_length"] = len(ranges)
+            params["positions_name"] = share_array(
+                positions[changed], active, generation
+            )
+    else:
+        params["positions_name"] = share_array(positions, active, generation)
+    if extracted.channels:
+        params["channels"] = share_channels(active, extracted, generation)
+
+    synced_mesh.topology = topology
+    if sync_delta_threshold > 0:
+        synced_mesh.positions = positions
+    connection = active.connection
+    if not connection.shared_memory:
+        connection.send({"id": "sync_mesh", "params": params})
+        return
+    # a frame with indices and all positions replaces any older frame for the path
+    complete = bool(params["indices_name"]) and not params["ranges_name"]
+    names = [
+        params[name]
+        for name in ("positions_name", "indices_name", "ranges_name")
+        if params.get(name)
+    ]
+    names.extend(channel[1] for channel in params.get("channels", ()))
+    buffers = active.buffers
+
+    def release():
+        for name in names:
+            buffers.release(name, generation)
+
+    connection.send(
+        {"id": "sync_mesh", "params": params},
+        key=("sync_mesh", path),
+        supersedes=complete,
+        on_drop=release,
+    )
+
+
+def share_channels(
+    active: Session, extracted: ExtractedMesh, generation: int
+) -> list[list[Any]]:
+    # manifest rows: name, buffer, dtype, width, domain
+    # corner rows follow the indices, point rows the vertices, triangle rows the triangles
+    manifest = list[list[Any]]()
+    for name, (data, domain) in extracted.channels.items():
+        if domain == "corner":
+            data = data[extracted.corners]
+        width = data.shape[1] if data.ndim > 1 else 1
+        buffer = share_array(data, active, generation)
+        manifest.append([name, buffer, data.dtype.str, width, domain])
+    return manifest
+
+
+def sync_channels(path: Path, file_path: Path, channels: list[str]):
+    assert session
+    for name in channels:
+        if name.partition(":")[0] not in channel_kinds:
+            raise ValueError(f"unknown channel {name}")
+    synced_mesh = session.meshes.get((path, file_path))
+    if not synced_mesh:
+        raise ValueError(f"no mesh at {path} in {file_path}")
+    synced_mesh.channels = tuple(channels)
+    # the next sync sends a whole frame with the new channels
+    synced_mesh.topology = None
+    session.dirty_meshes.add((path, file_path))
 
 
 def create_mesh(
@@ -127,80 +689,157 @@ def create_mesh(
     path: Path,
     file_path: Path,
     sync: bool,
+    topology: int | None = None,
+    positions_only: bool = False,
+    hash: str | None = None,
 ):
+    assert session
+    if positions_only:
+        update_mesh_positions(
+            positions_name, vertices_length, path, file_path, sync, topology
+        )
+        return
+    if hash and (mesh := cached_mesh(hash)):
+        link_cached_mesh(mesh, path, file_path, sync, topology, hash)
+        return
+
     mesh = bpy.data.meshes.new("Mesh")
-    assert collection_name and synced
-    collection = bpy.data.collections[collection_name]
-    obj = blender_util.create_object_hierarchy_from_path(
-        collection, path, file_path, synced.objects, synced.collections
-    )
 
     if positions_name:
-        positions_shared = SharedMemory(name=positions_name)
+        positions_shared = open_buffer(positions_name)
         verts = ndarray(
             (vertices_length, 3),
             float32,
             positions_shared.buf,
         )
     else:
-        verts = []
+        verts = empty((0, 3), float32)
     if triangles_name:
-        triangles_shared = SharedMemory(name=triangles_name)
+        triangles_shared = open_buffer(triangles_name)
         faces = ndarray(
             (triangles_length, 3),
             int32,
             triangles_shared.buf,
         )
     else:
-        faces = []
+        faces = empty((0, 3), int32)
 
-    mesh.from_pydata(verts, [], faces)
-    mesh.update()
-    obj.data = mesh
+    blender_util.build_triangle_mesh(mesh, verts, faces)
+    obj = resolve_object(path, file_path, mesh)
+    if hash:
+        cache_mesh(hash, mesh, verts.nbytes + faces.nbytes)
 
-    synced.meshes[(path, file_path)] = SyncedMesh(obj.name, sync)
+    session.meshes[(path, file_path)] = SyncedMesh(
+        obj.name, sync, source_topology=topology, hash=hash
+    )
+    session.object_paths[obj.name] = (path, file_path)
 
-def create_cube(
-    size: float,
+
+def cache_mesh(hash: str, mesh: bpy.types.Mesh, size: int):
+    assert session
+    uncache_mesh(hash)
+    session.mesh_cache[hash] = (mesh.name, size)
+    session.mesh_cache_bytes += size
+    while session.mesh_cache_bytes > mesh_cache_limit and len(session.mesh_cache) > 1:
+        # evicted meshes stay linked to their objects, they just stop being shared
+        _, (name, evicted_size) = session.mesh_cache.popitem(last=False)
+        session.mesh_cache_bytes -= evicted_size
+        if evicted := bpy.data.meshes.get(name):
+            remove_unused_mesh(evicted)
+
+
+def uncache_mesh(hash: str):
+    assert session
+    if entry := session.mesh_cache.pop(hash, None):
+        session.mesh_cache_bytes -= entry[1]
+
+
+def cached_mesh(hash: str) -> bpy.types.Mesh | None:
+    assert session
+    if not (entry := session.mesh_cache.get(hash)):
+        return None
+    if not (mesh := bpy.data.meshes.get(entry[0])):
+        uncache_mesh(hash)
+        return None
+    session.mesh_cache.move_to_end(hash)
+    return mesh
+
+
+def link_cached_mesh(
+    mesh: bpy.types.Mesh,
     path: Path,
     file_path: Path,
+    sync: bool,
+    topology: int | None,
+    hash: str,
 ):
-    mesh = bpy.data.meshes.new("Mesh")
-    assert collection_name and synced
-    collection = bpy.data.collections[collection_name]
-    obj = blender_util.create_object_hierarchy_from_path(
-        collection, path, file_path, synced.objects, synced.collections
+    assert session
+    obj = resolve_object(path, file_path, mesh)
+    session.meshes[(path, file_path)] = SyncedMesh(
+        obj.name, sync, source_topology=topology, hash=hash
     )
+    session.object_paths[obj.name] = (path, file_path)
 
-    half_size = size / 2
-    # Define vertices and faces
-    verts = array(
-        (
-            (-1.0, -1.0, -1.0),
-            (1.0, -1.0, -1.0),
-            (1.0, 1.0, -1.0),
-            (-1.0, 1.0, -1.0),
-            (-1.0, -1.0, 1.0),
-            (1.0, -1.0, 1.0),
-            (1.0, 1.0, 1.0),
-            (-1.0, 1.0, 1.0),
-        )
+
+def link_mesh(
+    offer: int,
+    hash: str,
+    path: Path,
+    file_path: Path,
+    sync: bool,
+    topology: int | None = None,
+):
+    assert session
+    if mesh := cached_mesh(hash):
+        link_cached_mesh(mesh, path, file_path, sync, topology, hash)
+    session.connection.send(
+        {"id": "mesh_offer", "params": {"offer": offer, "hit": mesh is not None}},
+        urgent=True,
     )
-    verts *= half_size
-
-    faces = [
-        (0, 1, 2, 3),  # Bottom
-        (4, 5, 6, 7),  # Top
-        (0, 1, 5, 4),  # Front
-        (2, 3, 7, 6),  # Back
-        (1, 2, 6, 5),  # Right
-        (3, 0, 4, 7),  # Left
-    ]
-    mesh.from_pydata(verts, [], faces)
+
+
+def update_mesh_positions(
+    positions_name: str,
+    vertices_length: int,
+    path: Path,
+    file_path: Path,
+    sync: bool,
+    topology: int | None,
+):
+    assert session
+    synced_mesh = session.meshes.get((path, file_path))
+    if not synced_mesh or synced_mesh.source_topology != topology:
+        raise ValueError(f"no mesh with matching topology at {path} in {file_path}")
+    obj = bpy.data.objects[synced_mesh.obj_name]
+    mesh = obj.data
+    assert isinstance(mesh, bpy.types.Mesh)
+    if len(mesh.vertices) != vertices_length:
+        raise ValueError(f"vertex count mismatch at {path} in {file_path}")
+    synced_mesh.sync = sync
+    if not positions_name:
+        return
+    # the content no longer matches its hash, and other objects keep the original
+    if synced_mesh.hash:
+        if cached := session.mesh_cache.get(synced_mesh.hash):
+            if cached[0] == mesh.name:
+                uncache_mesh(synced_mesh.hash)
+        synced_mesh.hash = None
+    if mesh.users > 1:
+        mesh = mesh.copy()
+        obj.data = mesh
+    positions_shared = open_buffer(positions_name)
+    positions = ndarray(vertices_length * 3, float32, positions_shared.buf)
+    mesh.vertices.foreach_set("co", positions)
     mesh.update()
-    obj.data = mesh
 
-    synced.meshes[(path, file_path)] = SyncedMesh(obj.name, False)
+
+def create_cube(
+    size: float,
+    path: Path,
+    file_path: Path,
+):
+    create_primitive("cube", [size], path, file_path)
+
 
 def create_cylinder(
     radius: float,
@@ -208,77 +847,169 @@ def create_cylinder(
     axis: str,
     path: Path,
     file_path: Path,
+    segments: int = 32,
 ):
-    mesh = bpy.data.meshes.new("Mesh")
-    assert collection_name and synced
-    collection = bpy.data.collections[collection_name]
-    obj = blender_util.create_object_hierarchy_from_path(
-        collection, path, file_path, synced.objects, synced.collections
-    )
+    create_primitive("cylinder", [radius, height], path, file_path, axis, segments)
 
-    matrix = Matrix.Identity(4)
-    if axis == "X":
-        matrix = Matrix.Rotation(pi / 2, 4, (0, 1, 0))
-    elif axis == "Y":
-        matrix = Matrix.Rotation(pi / 2, 4, (-1, 0, 0))
-    b_mesh = bmesh.new()
-    bmesh.ops.create_cone(
-        b_mesh,
-        cap_ends=True,
-        cap_tris=False,
-        segments=32,
-        radius1=radius,
-        radius2=radius,
-        depth=height,
-        matrix=matrix,
-    )
-
-    # Write the bmesh into the mesh
-    b_mesh.to_mesh(mesh)  # type: ignore
-    b_mesh.free()
 
-    mesh.update()
-    obj.data = mesh
+def create_primitive(
+    kind: str,
+    dimensions: list[float],
+    path: Path,
+    file_path: Path,
+    axis: str = "Z",
+    segments: int = 32,
+):
+    assert session
+    # identical primitives share one template mesh through the session mesh cache
+    sizes = ",".join(str(float(size)) for size in dimensions)
+    key = f"primitive/{kind}/{sizes}/{axis}/{segments}"
+    if not (mesh := cached_mesh(key)):
+        geometry = primitive.build(kind, dimensions, axis, segments)
+        mesh = bpy.data.meshes.new(kind.capitalize())
+        blender_util.build_mesh(mesh, *geometry)
+        cache_mesh(key, mesh, sum(array.nbytes for array in geometry))
+    obj = resolve_object(path, file_path, mesh)
 
-    synced.meshes[(path, file_path)] = SyncedMesh(obj.name, False)
+    session.meshes[(path, file_path)] = SyncedMesh(obj.name, False, hash=key)
+    session.object_paths[obj.name] = (path, file_path)
 
 
-def receive_buffer(name: str):
-    assert synced
-    synced.connection.send(
+def receive_buffer(name: str, connection: Connection | None = None):
+    if not connection:
+        assert session
+        connection = session.connection
+    connection.send(
         {
-            "id": "recieved_buffer",
+            "id": "received_buffer",
             "params": {
                 "name": name,
             },
-        }
+        },
+        urgent=True,
     )
 
 
-def create_buffer(size: int) -> SharedMemory:
-    assert synced
-    ret = SharedMemory(create=True, size=size)
-    synced.buffers[ret.name] = ret
-    return ret
+def create_buffer(
+    size: int, active: Session | None = None, generation: int | None = None
+) -> SharedMemory:
+    active = active or session
+    assert active
+    return active.buffers.acquire(size, generation)
+
 
+def release_buffer(name: str, generation: int | None = None):
+    assert session
+    session.buffers.release(name, generation)
 
-def release_buffer(name: str):
-    assert synced
-    assert synced.buffers.pop(name)
 
+def create_instances(
+    path: Path,
+    file_path: Path,
+    matrices: ndarray | None = None,
+    source_path: Path | None = None,
+    positions_name: str = "",
+    triangles_name: str = "",
+    vertices_length: int = 0,
+    triangles_length: int = 0,
+    matrices_name: str = "",
+    matrices_length: int = 0,
+):
+    assert session
+    if matrices_name:
+        matrices = ndarray(
+            (matrices_length, 4, 4), float32, open_buffer(matrices_name).buf
+        )
+    assert matrices is not None
+    key = (path, file_path)
+    instances = session.instances.get(key)
+    if source_path is not None:
+        source = session.index.get(source_path, file_path)
+        if not source or not isinstance(source.data, bpy.types.Mesh):
+            raise ValueError(f"no mesh at {source_path} in {file_path}")
+        mesh = source.data
+    elif positions_name:
+        positions_shared = open_buffer(positions_name)
+        triangles_shared = open_buffer(triangles_name)
+        mesh = bpy.data.meshes.new("Instance")
+        blender_util.build_triangle_mesh(
+            mesh,
+            ndarray((vertices_length, 3), float32, positions_shared.buf),
+            ndarray((triangles_length, 3), int32, triangles_shared.buf),
+        )
+    elif instances:
+        mesh = instances.mesh
+    else:
+        raise ValueError(f"no source geometry for instances at {path} in {file_path}")
 
-def clear():
-    assert collection_name and synced
-    synced.meshes.clear()
-    synced.xforms.clear()
-    for obj_name in synced.objects.values():
-        obj = bpy.data.objects[obj_name]
+    parent = resolve_object(path, file_path)
+    if not instances:
+        instances = session.instances[key] = SyncedInstances(mesh, [])
+    previous, instances.mesh = instances.mesh, mesh
+    matrices = asarray(matrices, float32).reshape(-1, 4, 4)
+    objects = instances.objects
+
+    # every copy links the same mesh datablock, only the object is per instance
+    collection = parent.users_collection[0]
+    for index in range(len(objects), len(matrices)):
+        obj = bpy.data.objects.new(f"{index}/{parent.name}", mesh)
+        collection.objects.link(obj)
+        obj.parent = parent
+        objects.append(obj)
+    for obj in objects[len(matrices) :]:
         bpy.data.objects.remove(obj, do_unlink=True)
-    synced.objects.clear()
-    for file_collection_name in synced.collections.values():
-        collection = bpy.data.collections[file_collection_name]
-        bpy.data.collections.remove(collection, do_unlink=True)
-    synced.collections.clear()
+    del objects[len(matrices) :]
+
+    for obj, matrix in zip(objects, matrices):
+        if obj.data != mesh:
+            obj.data = mesh
+        obj.matrix_basis = Matrix(matrix)
+    if previous is not mesh:
+        remove_unused_mesh(previous)
+
+
+def clear(file_path: Path | None = None, path: Path | None = None):
+    assert session
+
+    def in_scope(key: tuple[Path, Path]) -> bool:
+        if file_path is not None and key[1] != file_path:
+            return False
+        return path is None or key[0].is_relative_to(path)
+
+    objects = list[bpy.types.Object]()
+    collections = list[bpy.types.Collection]()
+    file_paths = list(session.index.files) if file_path is None else [file_path]
+    for scoped_file_path in file_paths:
+        removed, collection = session.index.remove(path, scoped_file_path)
+        objects += removed
+        if collection:
+            collections.append(collection)
+    for key in [key for key in session.instances if in_scope(key)]:
+        objects += session.instances.pop(key).objects
+
+    for table in (session.meshes, session.xforms):
+        for key in [key for key in table if in_scope(key)]:
+            del table[key]
+    session.dirty_meshes = set(key for key in session.dirty_meshes if not in_scope(key))
+    session.dirty_xforms = set(key for key in session.dirty_xforms if not in_scope(key))
+    session.object_paths = dict(
+        (name, key) for name, key in session.object_paths.items() if not in_scope(key)
+    )
+    slots = [key for key in session.xform_slots if not in_scope(key)]
+    if len(slots) != len(session.xform_slots):
+        session.xform_slots = dict((key, slot) for slot, key in enumerate(slots))
+        session.xform_slots_version += 1
+
+    # meshes whose every user goes away with the objects would be left orphaned
+    users = Counter(obj.data for obj in objects if isinstance(obj.data, bpy.types.Mesh))
+    meshes = [mesh for mesh, count in users.items() if mesh.users <= count]
+    mesh_names = set(mesh.name for mesh in meshes)
+    for hash, (name, _) in list(session.mesh_cache.items()):
+        if name in mesh_names:
+            uncache_mesh(hash)
+
+    # one batch_remove avoids rescanning every datablock per removed ID
+    bpy.data.batch_remove([*objects, *meshes, *collections])
 
 
 def set_xform(
@@ -289,43 +1020,193 @@ def set_xform(
     file_path: Path,
     sync: bool,
 ):
-    assert collection_name and synced
-    collection = bpy.data.collections[collection_name]
-    obj = blender_util.create_object_hierarchy_from_path(
-        collection, path, file_path, synced.objects, synced.collections
-    )
+    assert session
+    obj = resolve_object(path, file_path)
     obj.location = translation
     obj.rotation_mode = "QUATERNION"
     obj.rotation_quaternion = (rotation[3], rotation[0], rotation[1], rotation[2])
     obj.scale = scale
 
-    synced.xforms[(path, file_path)] = SyncedXform(obj.name, sync)
+    track_xform(path, file_path, obj, sync)
+
+
+def set_xforms(
+    paths: list[Path],
+    file_path: Path,
+    sync: bool,
+    transforms: ndarray | None = None,
+    matrices: ndarray | None = None,
+    matrices_name: str = "",
+):
+    assert session
+    objects = [resolve_object(path, file_path) for path in paths]
+    if matrices_name:
+        matrices = ndarray((len(paths), 4, 4), float32, open_buffer(matrices_name).buf)
+    if matrices is not None:
+        for obj, matrix in zip(objects, asarray(matrices, float32).reshape(-1, 4, 4)):
+            obj.matrix_basis = Matrix(matrix)
+    elif transforms is not None:
+        # translation xyz, rotation xyzw, scale xyz per row
+        for obj, transform in zip(
+            objects, asarray(transforms, float32).reshape(-1, 10).tolist()
+        ):
+            obj.location = transform[0:3]
+            obj.rotation_mode = "QUATERNION"
+            obj.rotation_quaternion = (transform[6], *transform[3:6])
+            obj.scale = transform[7:10]
+
+    for path, obj in zip(paths, objects):
+        track_xform(path, file_path, obj, sync)
 
 
-def run(data: Any):
+def decode(data: Any) -> tuple[str, Any, int]:
     id = data["id"]
     params = data["params"]
-    if params:
+    if id == "batch":
+        params = [decode(command) for command in params["commands"]]
+    elif params:
         if path := params.get("path"):
             params["path"] = Path(path)
         if path := params.get("file_path"):
             params["file_path"] = Path(path)
+        if paths := params.get("paths"):
+            params["paths"] = [Path(path) for path in paths]
+        if path := params.get("source_path"):
+            params["source_path"] = Path(path)
+    return id, params, data.get("request_id", 0)
+
+
+def execute(id: str, params: Any) -> Any:
+    match id:
+        case "create_mesh":
+            create_mesh(**params)
+        case "create_cube":
+            create_cube(**params)
+        case "create_cylinder":
+            create_cylinder(**params)
+        case "create_primitive":
+            create_primitive(**params)
+        case "clear":
+            clear(**(params or {}))
+        case "set_xform":
+            set_xform(**params)
+        case "set_xforms":
+            set_xforms(**params)
+        case "link_mesh":
+            link_mesh(**params)
+        case "create_instances":
+            create_instances(**params)
+        case "received_buffer":
+            release_buffer(**params)
+        case "sync_channels":
+            sync_channels(**params)
+        case "stats":
+            return stats()
+        case "batch":
+            try:
+                # a failed command is reported on its own, the rest still run
+                for command_id, command_params, request_id in params:
+                    execute_request(command_id, command_params, request_id)
+            finally:
+                view_layer = bpy.context.view_layer
+                assert view_layer
+                view_layer.update()
+        case _:
+            raise ValueError(f"unknown command id {id}")
+
+
+def execute_request(id: str, params: Any, request_id: int, wait: float = 0.0):
+    assert session
+    start = perf_counter()
+    value = error = None
+    try:
+        value = execute(id, params)
+    except Exception as e:
+        logger.exception("command %s failed", id)
+        error = f"{type(e).__name__}: {e}"
+    # after the except block, so no traceback keeps views of the segments alive
+    close_opened()
+    release_params(params, session.connection)
+    metrics.registry.executed(id, wait, perf_counter() - start, error is not None)
+    reply(request_id, error, value=value)
+
+
+def reply(
+    request_id: int,
+    error: str | None = None,
+    connection: Connection | None = None,
+    value: Any = None,
+):
+    # request id 0 marks a command nobody waits for
+    if not request_id:
+        return
+    if not connection:
+        assert session
+        connection = session.connection
+    params: dict[str, Any] = {"error": error}
+    if value is not None:
+        params["value"] = value
+    connection.send(
+        {"id": "result", "params": params, "request_id": request_id}, urgent=True
+    )
+
+
+def run(connection: Connection, data: Any):
+    id, params, request_id = decode(data)
+    pushed = perf_counter()
+    queue.push(
+        lambda: execute_for(connection, id, params, request_id, pushed), connection
+    )
+
+
+def execute_for(
+    connection: Connection, id: str, params: Any, request_id: int, pushed: float
+):
+    if not (active := sessions.get(connection)):
+        logger.warning("no session for command %s", id)
+        release_params(params, connection)
+        reply(request_id, "no session", connection)
+        return
+    with use_session(active):
+        execute_request(id, params, request_id, perf_counter() - pushed)
+
+
+def stats() -> dict[str, Any]:
+    snapshot = metrics.registry.snapshot()
+    snapshot["queue"] = {"depth": queue.depth, "drain_rate": queue.drain_rate}
+    snapshot["sessions"] = {}
+    for active in list(sessions.values()):
+        buffers = active.buffers
+        sender = active.connection.sender
+        snapshot["sessions"][active.name] = {
+            "queue_depth": queue.owner_depth(active.connection),
+            "shm_outstanding": buffers.outstanding,
+            "shm_allocated": buffers.allocated,
+            "shm_high_water": buffers.high_water,
+            "send_depth": sender.depth,
+            "send_bytes": sender.bytes,
+            "send_coalesced": sender.coalesced,
+            "send_dropped": sender.dropped,
+        }
+        if job := active.job:
+            snapshot["sessions"][active.name]["sync"] = {
+                "done": job.done,
+                "total": job.total,
+            }
+    return snapshot
+
+
+# periodic export of stats() as json, an empty path disables it
+metrics_path = ""
+metrics_interval = 5.0
+
 
-    def run_():
-        match id:
-            case "create_mesh":
-                create_mesh(**params)
-            case "create_cube":
-                create_cube(**params)
-            case "create_cylinder":
-                create_cylinder(**params)
-            case "clear":
-                clear()
-            case "set_xform":
-                set_xform(**params)
-            case "received_buffer":
-                release_buffer(**params)
-            case _:
-                print(f"unknown command id {id}")
-
-    bpy.app.timers.register(run_)
+def export_metrics() -> float | None:
+    if not metrics_path:
+        return None
+    try:
+        with open(metrics_path, "w") as file:
+            json.dump(stats(), file, indent=1)
+    except OSError:
+        logger.exception("could not write metrics to %s", metrics_path)
+    return metrics_interval
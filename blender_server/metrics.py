@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+import threading
+from time import perf_counter
+from typing import Any
+
+
+@dataclass
+class CommandMetrics:
+    received: int = 0
+    executed: int = 0
+    errors: int = 0
+    bytes: int = 0
+    decode: float = 0.0
+    wait: float = 0.0
+    execute: float = 0.0
+    max_execute: float = 0.0
+
+
+class Metrics:
+    # written from the network threads and the main thread
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.commands = dict[str, CommandMetrics]()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.started = perf_counter()
+
+    def command(self, id: str) -> CommandMetrics:
+        metrics = self.commands.get(id)
+        if metrics is None:
+            metrics = self.commands[id] = CommandMetrics()
+        return metrics
+
+    def received(self, id: str, size: int, decode: float):
+        with self.lock:
+            metrics = self.command(id)
+            metrics.received += 1
+            metrics.bytes += size
+            metrics.decode += decode
+            self.bytes_in += size
+
+    def executed(self, id: str, wait: float, execute: float, failed: bool):
+        with self.lock:
+            metrics = self.command(id)
+            metrics.executed += 1
+            metrics.errors += failed
+            metrics.wait += wait
+            metrics.execute += execute
+            metrics.max_execute = max(metrics.max_execute, execute)
+
+    def sent(self, size: int):
+        with self.lock:
+            self.bytes_out += size
+
+    def reset(self):
+        with self.lock:
+            self.commands.clear()
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.started = perf_counter()
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.lock:
+            elapsed = max(perf_counter() - self.started, 1e-9)
+            commands = {
+                id: {
+                    "received": metrics.received,
+                    "executed": metrics.executed,
+                    "errors": metrics.errors,
+                    "rate": metrics.executed / elapsed,
+                    "bytes": metrics.bytes,
+                    "decode_ms": 1000 * metrics.decode / max(metrics.received, 1),
+                    "wait_ms": 1000 * metrics.wait / max(metrics.executed, 1),
+                    "execute_ms": 1000 * metrics.execute / max(metrics.executed, 1),
+                    "max_execute_ms": 1000 * metrics.max_execute,
+                }
+                for id, metrics in self.commands.items()
+            }
+            return {
+                "elapsed": elapsed,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_in_rate": self.bytes_in / elapsed,
+                "bytes_out_rate": self.bytes_out / elapsed,
+                "commands": commands,
+            }
+
+
+registry = Metrics()
@@ -0,0 +1,196 @@
+from numpy import (
+    arange,
+    array,
+    asarray,
+    concatenate,
+    cos,
+    cumsum,
+    empty,
+    float32,
+    full,
+    int32,
+    linspace,
+    ndarray,
+    outer,
+    pi,
+    sin,
+    stack,
+    zeros,
+)
+
+# positions, corner vertices, loop starts
+Geometry = tuple[ndarray, ndarray, ndarray]
+
+axis_rotations = {
+    "X": array(((0, 0, -1), (0, 1, 0), (1, 0, 0)), float32),
+    "Y": array(((1, 0, 0), (0, 0, -1), (0, 1, 0)), float32),
+}
+
+
+def orient(positions: ndarray, axis: str) -> ndarray:
+    if (rotation := axis_rotations.get(axis)) is not None:
+        return positions @ rotation
+    return positions
+
+
+def cube(size: float) -> Geometry:
+    positions = array(
+        (
+            (-1.0, -1.0, -1.0),
+            (1.0, -1.0, -1.0),
+            (1.0, 1.0, -1.0),
+            (-1.0, 1.0, -1.0),
+            (-1.0, -1.0, 1.0),
+            (1.0, -1.0, 1.0),
+            (1.0, 1.0, 1.0),
+            (-1.0, 1.0, 1.0),
+        ),
+        float32,
+    )
+    positions *= size / 2
+    corner_vertices = array(
+        (
+            (0, 1, 2, 3),  # Bottom
+            (4, 5, 6, 7),  # Top
+            (0, 1, 5, 4),  # Front
+            (2, 3, 7, 6),  # Back
+            (1, 2, 6, 5),  # Right
+            (3, 0, 4, 7),  # Left
+        ),
+        int32,
+    ).ravel()
+    return positions, corner_vertices, arange(0, 24, 4, dtype=int32)
+
+
+def plane(size: float, axis: str = "Z") -> Geometry:
+    positions = array(
+        ((-1.0, -1.0, 0.0), (1.0, -1.0, 0.0), (1.0, 1.0, 0.0), (-1.0, 1.0, 0.0)),
+        float32,
+    )
+    positions *= size / 2
+    return orient(positions, axis), arange(4, dtype=int32), zeros(1, int32)
+
+
+def revolve(
+    radii: ndarray,
+    heights: ndarray,
+    segments: int,
+    bottom: float | None = None,
+    top: float | None = None,
+) -> Geometry:
+    # profile rings from bottom to top swept around z, each end is closed by a pole
+    # at the given height or otherwise by a flat n-gon
+    rings = len(radii)
+    angles = linspace(0, 2 * pi, segments, endpoint=False)
+    ring_positions = empty((rings, segments, 3), float32)
+    ring_positions[..., 0] = outer(radii, cos(angles))
+    ring_positions[..., 1] = outer(radii, sin(angles))
+    ring_positions[..., 2] = asarray(heights)[:, None]
+    positions = [ring_positions.reshape(-1, 3)]
+
+    current = arange(segments, dtype=int32)
+    following = (current + 1) % segments
+    lower = arange(rings - 1, dtype=int32)[:, None] * segments
+    sides = stack(
+        (
+            lower + current,
+            lower + following,
+            lower + following + segments,
+            lower + current + segments,
+        ),
+        axis=-1,
+    )
+    faces = [sides.ravel()]
+    sizes = [full((rings - 1) * segments, 4)]
+    last = current + (rings - 1) * segments
+    pole = rings * segments
+    if bottom is None:
+        faces.append(current[::-1])
+        sizes.append(full(1, segments))
+    else:
+        positions.append(array(((0.0, 0.0, bottom),), float32))
+        faces.append(stack((full(segments, pole), following, current), axis=1).ravel())
+        sizes.append(full(segments, 3))
+        pole += 1
+    if top is None:
+        faces.append(last)
+        sizes.append(full(1, segments))
+    else:
+        positions.append(array(((0.0, 0.0, top),), float32))
+        faces.append(
+            stack((full(segments, pole), last, following + last[0]), axis=1).ravel()
+        )
+        sizes.append(full(segments, 3))
+    face_sizes = concatenate(sizes)
+    loop_starts = (cumsum(face_sizes) - face_sizes).astype(int32)
+    return concatenate(positions), concatenate(faces).astype(int32), loop_starts
+
+
+def cone(
+    radius1: float, radius2: float, height: float, axis: str, segments: int = 32
+) -> Geometry:
+    # a zero radius end becomes a pole instead of a ring
+    ends = ((radius1, -height / 2), (radius2, height / 2))
+    radii = array([radius for radius, _ in ends if radius > 0])
+    heights = array([z for radius, z in ends if radius > 0])
+    if not len(radii):
+        raise ValueError("a cone needs a non zero radius")
+    positions, corner_vertices, loop_starts = revolve(
+        radii,
+        heights,
+        segments,
+        bottom=None if radius1 > 0 else -height / 2,
+        top=None if radius2 > 0 else height / 2,
+    )
+    return orient(positions, axis), corner_vertices, loop_starts
+
+
+def cylinder(radius: float, height: float, axis: str, segments: int = 32) -> Geometry:
+    return cone(radius, radius, height, axis, segments)
+
+
+def sphere(radius: float, axis: str = "Z", segments: int = 32) -> Geometry:
+    rings = max(segments // 2, 2)
+    polar = linspace(0, pi, rings + 1)[1:-1]
+    positions, corner_vertices, loop_starts = revolve(
+        radius * sin(polar), -radius * cos(polar), segments, -radius, radius
+    )
+    return orient(positions, axis), corner_vertices, loop_starts
+
+
+def capsule(radius: float, height: float, axis: str, segments: int = 32) -> Geometry:
+    # height is end to end, the straight part is what the two hemispheres leave
+    half = max(height - 2 * radius, 0) / 2
+    polar = linspace(0, pi / 2, max(segments // 4, 1) + 1)[1:]
+    radii = radius * sin(polar)
+    # without a straight part both hemispheres share the equator ring
+    shared = 0 if half > 0 else 1
+    radii = concatenate((radii, radii[::-1][shared:]))
+    heights = concatenate(
+        (-half - radius * cos(polar), (half + radius * cos(polar))[::-1][shared:])
+    )
+    positions, corner_vertices, loop_starts = revolve(
+        radii, heights, segments, -half - radius, half + radius
+    )
+    return orient(positions, axis), corner_vertices, loop_starts
+
+
+def build(
+    kind: str, dimensions: list[float], axis: str = "Z", segments: int = 32
+) -> Geometry:
+    if segments < 3:
+        raise ValueError(f"a {kind} needs at least 3 segments")
+    match kind:
+        case "cube":
+            return cube(*dimensions)
+        case "plane":
+            return plane(*dimensions, axis)
+        case "cylinder":
+            return cylinder(*dimensions, axis, segments)
+        case "cone":
+            return cone(*dimensions, axis, segments)
+        case "sphere":
+            return sphere(*dimensions, axis, segments)
+        case "capsule":
+            return capsule(*dimensions, axis, segments)
+    raise ValueError(f"unknown primitive {kind}")
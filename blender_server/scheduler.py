@@ -0,0 +1,75 @@
+from collections import deque
+from collections.abc import Callable, Hashable
+import logging
+import threading
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+
+class CommandQueue:
+    def __init__(self, budget_ms: float = 5.0, interval: float = 0.01) -> None:
+        self.queues = dict[Hashable, deque[Callable[[], None]]]()
+        # owners with pending commands, served round robin one command at a time
+        self.ready = deque[Hashable]()
+        self.lock = threading.Lock()
+        self.budget_ms = budget_ms
+        self.interval = interval
+        self.drain_rate = 0.0
+        self.last_tick = perf_counter()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in list(self.queues.values()))
+
+    def owner_depth(self, owner: Hashable) -> int:
+        queue = self.queues.get(owner)
+        return len(queue) if queue else 0
+
+    def push(self, func: Callable[[], None], owner: Hashable = None):
+        with self.lock:
+            queue = self.queues.get(owner)
+            if queue is None:
+                queue = self.queues[owner] = deque()
+            if not queue:
+                self.ready.append(owner)
+            queue.append(func)
+
+    def pop(self) -> Callable[[], None] | None:
+        with self.lock:
+            if not self.ready:
+                return None
+            owner = self.ready.popleft()
+            queue = self.queues[owner]
+            func = queue.popleft()
+            if queue:
+                self.ready.append(owner)
+            else:
+                del self.queues[owner]
+            return func
+
+    def drain(self) -> float:
+        start = perf_counter()
+        deadline = start + self.budget_ms / 1000
+        count = 0
+        while func := self.pop():
+            try:
+                func()
+            except Exception:
+                logger.exception("queued command failed")
+            count += 1
+            if perf_counter() >= deadline:
+                break
+
+        elapsed = start - self.last_tick
+        self.last_tick = start
+        if elapsed > 0:
+            self.drain_rate = 0.8 * self.drain_rate + 0.2 * count / elapsed
+
+        # keep draining on the next event loop iteration while there is a backlog
+        return 0.0 if self.ready else self.interval
+
+    def clear(self):
+        with self.lock:
+            self.queues.clear()
+            self.ready.clear()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from asyncio import (
+    IncompleteReadError,
     StreamWriter,
     StreamReader,
     AbstractEventLoop,
@@ -8,44 +9,84 @@ from asyncio import (
     new_event_loop,
     set_event_loop,
     start_server,
+    start_unix_server,
     create_task,
     CancelledError,
 )
-from collections.abc import Callable
-import json
+from collections.abc import Callable, Hashable
+from itertools import count
+import logging
+import os
+import socket
+import stat
 import threading
+from time import perf_counter
 from typing import Any
 
+from . import metrics
+from . import protocol
+
+logger = logging.getLogger(__name__)
+
+
+def remove_stale_socket(path: str):
+    # only a socket nobody listens on is left behind by a crashed server
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise FileExistsError(f"another server listens on {path}")
+
 
 class Connection:
     def __init__(self, server: Server, writer: StreamWriter) -> None:
         self.server = server
         self.writer = writer
+        self.codec: protocol.JsonCodec | protocol.BinaryCodec = protocol.json_codec
+        # buffers travel inline when the peer can not map our shared memory
+        self.shared_memory = True
+        self.compression = 0
+        self.inline = protocol.InlineBuffers()
+        self.inline_ids = count(1)
+        self.sender = protocol.Sender()
 
-    def send(self, data: Any):
-        if not self.server.loop:
-            print("no connection")
-            return
-
-        def send_():
-            if not self.writer:
-                print("no connection")
-                return
-            bin: bytes = json.dumps(data).encode()
-            length = len(bin)
-            self.writer.write(length.to_bytes(length=4))
-            self.writer.write(bin)
-            create_task(self.writer.drain())
+    def send_buffer(self, data: memoryview) -> str:
+        name = f"inline/{next(self.inline_ids)}"
+        for chunk in protocol.buffer_chunks(name, data, self.compression):
+            self.send(chunk)
+        return name
 
-        self.server.loop.call_soon_threadsafe(send_)
+    def send(
+        self,
+        data: Any,
+        key: Hashable = None,
+        supersedes: bool = False,
+        droppable: bool = False,
+        on_drop: Callable[[], None] | None = None,
+        urgent: bool = False,
+    ) -> bool:
+        # encoded on the calling thread, the writer task only joins and writes frames
+        frame = self.codec.encode(data)
+        metrics.registry.sent(len(frame))
+        return self.sender.put(
+            frame, key, supersedes, droppable, on_drop, urgent=urgent
+        )
 
 
 class Server:
     def __init__(
         self,
-        run_command: Callable[[Any], None],
+        run_command: Callable[[Connection, Any], None],
         on_connection_start: Callable[[Connection], None],
-        on_connection_end: Callable[[], None],
+        on_connection_end: Callable[[Connection], None],
     ) -> None:
         self.on = False
         self.thread: threading.Thread | None = None
@@ -55,30 +96,47 @@ class Server:
         self.on_connection_start = on_connection_start
         self.on_connection_end = on_connection_end
 
-    def start(self, port: int):
+    def start(self, port: int, host: str | None = None, socket_path: str | None = None):
         if not self.on:
+            if socket_path:
+                remove_stale_socket(socket_path)
+            # segments of a crashed server or client are never unlinked otherwise
+            if removed := protocol.remove_stale_segments():
+                logger.info("removed %s stale shared memory segments", removed)
             self.on = True
             self.loop = new_event_loop()
             set_event_loop(self.loop)
-            self.task = self.loop.create_task(self.create_task(port))
+            self.task = self.loop.create_task(self.create_task(port, host, socket_path))
             self.thread = threading.Thread(daemon=False, target=self.func)
             self.thread.start()
 
-    async def create_task(self, port: int):
-        server = await start_server(self.handle_client, port=port)
-        print(f"server started at port: {port}")
-        async with server:
-            await server.serve_forever()
+    async def create_task(self, port: int, host: str | None, socket_path: str | None):
+        if not socket_path:
+            # asyncio already sets TCP_NODELAY on stream sockets
+            server = await start_server(self.handle_client, host=host, port=port)
+            logger.info("server started at %s:%s", host or "*", port)
+            async with server:
+                await server.serve_forever()
+            return
+
+        server = await start_unix_server(self.handle_client, path=socket_path)
+        logger.info("server started at %s", socket_path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
 
     def func(self):
         assert self.loop is not None and self.task is not None
         try:
             self.loop.run_until_complete(self.task)
         except CancelledError:
-            print("server canceled")
+            logger.info("server canceled")
         finally:
             self.loop.close()
-            print("server ended")
+            logger.info("server ended")
 
     def end(self):
         if self.on:
@@ -93,36 +151,67 @@ class Server:
 
     async def handle_client(self, reader: StreamReader, writer: StreamWriter):
         addr = writer.get_extra_info("peername")
-        print(f"connection: {addr} started")
-        self.on_connection_start(Connection(self, writer))
+        logger.info("connection: %s started", addr)
+        connection = Connection(self, writer)
+        sender = create_task(connection.sender.run(writer))
+        self.on_connection_start(connection)
 
         try:
             try:
                 while True:
-                    length_bin = await reader.read(4)
-                    if not length_bin:
-                        print("connection closed")
-                        break
-                    data_length = int.from_bytes(length_bin)
-                    bin = await reader.read(data_length)
-                    if not bin:
-                        print("connection closed")
-                        break
+                    codec = connection.codec
+                    head, body = await codec.read_frame(reader)
+                    start = perf_counter()
                     try:
-                        data = json.loads(bin.decode())
-                        print(f"received: {data}")
-                    except Exception:
-                        print(f"unknown data: {bin}")
+                        data = codec.decode(head, body)
+                    except protocol.DecodeError as e:
+                        logger.warning(e)
+                        continue
+                    metrics.registry.received(
+                        data["id"], len(head) + len(body), perf_counter() - start
+                    )
+                    if data["id"] == "hello":
+                        params = data["params"]
+                        connection.codec = protocol.select_codec(params)
+                        connection.shared_memory = protocol.probe_shared_memory(
+                            params.get("shared_memory")
+                        )
+                        connection.compression = params.get("compression", 0)
+                        connection.sender.put(
+                            protocol.json_codec.encode(
+                                {
+                                    "id": "hello",
+                                    "params": {
+                                        "version": connection.codec.version,
+                                        "shared_memory": connection.shared_memory,
+                                    },
+                                }
+                            )
+                        )
+                        logger.info(
+                            "connection: %s protocol %s, shared memory %s",
+                            addr,
+                            connection.codec.version,
+                            connection.shared_memory,
+                        )
+                        continue
+                    if data["id"] == "buffer_chunk":
+                        # reassembled here so chunks never occupy the main thread
+                        connection.inline.add(**data["params"])
                         continue
-                    self.run_command(data)
+                    self.run_command(connection, data)
 
+            except IncompleteReadError:
+                logger.info("connection closed")
             except CancelledError:
-                print(f"connection: {addr} canceled.")
+                logger.info("connection: %s canceled.", addr)
             finally:
+                connection.sender.close()
+                sender.cancel()
                 writer.close()
                 await writer.wait_closed()
-                print(f"connection: {addr} ended")
+                logger.info("connection: %s ended", addr)
         except ConnectionError:
-            print(f"connection: {addr} lost")
+            logger.warning("connection: %s lost", addr)
         finally:
-            self.on_connection_end()
+            self.on_connection_end(connection)
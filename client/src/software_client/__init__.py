@@ -1,10 +1,24 @@
-from software_client.client import Client
+from software_client.client import Client, CommandError
 from software_client.command import (
+    allocate_array,
+    release_array,
     create_mesh,
+    publish_mesh,
     create_cube,
+    create_cylinder,
+    create_primitive,
+    create_plane,
+    create_sphere,
+    create_cone,
+    create_capsule,
+    create_instances,
     set_xform,
+    set_xforms,
+    set_matrices,
+    sync_channels,
     SyncMesh,
     SyncXform,
     RunCommands,
     clear,
+    stats,
 )
@@ -1,9 +1,131 @@
 import asyncio
 from collections.abc import Callable, Iterable
-import json
+from concurrent.futures import Future
+from contextlib import contextmanager
+import ctypes
+from dataclasses import dataclass
+from itertools import count
+import logging
 from multiprocessing.shared_memory import SharedMemory
 import threading
 from typing import Any
+from uuid import uuid4
+
+from software_client import protocol
+
+logger = logging.getLogger(__name__)
+
+
+class CommandError(Exception):
+    pass
+
+
+client_ids = count(1)
+
+
+def address(shared: SharedMemory) -> int:
+    return ctypes.addressof(ctypes.c_char.from_buffer(shared.buf))
+
+
+@dataclass
+class Segment:
+    shared: SharedMemory
+    size: int
+    # the producer holding it plus every consumer that has not acked it yet
+    refs: int = 1
+
+
+class SharedBuffers:
+    # segments this client created, pooled again once every reference is released
+    def __init__(
+        self, prefix: str, min_size: int = 4096, free_limit: int = 256 << 20
+    ) -> None:
+        self.prefix = prefix
+        self.ids = count(1)
+        self.min_size = min_size
+        self.free_limit = free_limit
+        self.segments = dict[str, Segment]()
+        self.free = dict[int, list[SharedMemory]]()
+        self.free_bytes = 0
+        # start address of every mapped segment, to recognise arrays living in one
+        self.addresses = dict[int, SharedMemory]()
+        # unlinked segments a producer array still maps, kept so they are not unmapped
+        self.detached = list[SharedMemory]()
+        self.lock = threading.Lock()
+
+    def create(self, size: int) -> SharedMemory:
+        size = max(self.min_size, 1 << (size - 1).bit_length())
+        with self.lock:
+            if free := self.free.get(size):
+                shared = free.pop()
+                self.free_bytes -= size
+                self.segments[shared.name] = Segment(shared, size)
+                return shared
+        shared = SharedMemory(
+            name=f"{self.prefix}{next(self.ids)}", create=True, size=size
+        )
+        with self.lock:
+            self.segments[shared.name] = Segment(shared, size)
+            self.addresses[address(shared)] = shared
+        return shared
+
+    def find(self, address: int, size: int) -> str | None:
+        with self.lock:
+            shared = self.addresses.get(address)
+            if shared and (segment := self.segments.get(shared.name)):
+                if size <= segment.size:
+                    return shared.name
+        return None
+
+    def retain(self, name: str):
+        with self.lock:
+            if segment := self.segments.get(name):
+                segment.refs += 1
+
+    def release(self, name: str):
+        with self.lock:
+            segment = self.segments.get(name)
+            if not segment:
+                return
+            segment.refs -= 1
+            if segment.refs > 0:
+                return
+            del self.segments[name]
+            if self.free_bytes + segment.size <= self.free_limit:
+                self.free.setdefault(segment.size, []).append(segment.shared)
+                self.free_bytes += segment.size
+                return
+            self.forget(segment.shared)
+        self.unlink(segment.shared)
+
+    @property
+    def outstanding(self) -> int:
+        with self.lock:
+            return sum(segment.size for segment in self.segments.values())
+
+    def forget(self, shared: SharedMemory):
+        self.addresses.pop(address(shared), None)
+
+    def unlink(self, shared: SharedMemory):
+        try:
+            shared.close()
+        except BufferError:
+            self.detached.append(shared)
+        try:
+            shared.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        with self.lock:
+            shared = [segment.shared for segment in self.segments.values()]
+            shared.extend(each for free in self.free.values() for each in free)
+            self.segments.clear()
+            self.free.clear()
+            self.free_bytes = 0
+            self.addresses.clear()
+        for each in shared:
+            self.unlink(each)
 
 
 class Client:
@@ -12,101 +134,248 @@ class Client:
         run_command: Callable[[Any], None],
         on_start: Iterable[Callable[[], None]],
         on_end: Iterable[Callable[[], None]],
+        max_in_flight: int = 256,
     ) -> None:
         self.on = False
         self.thread: threading.Thread | None = None
         self.loop: asyncio.AbstractEventLoop | None = None
         self.task: asyncio.Task[None] | None = None
         self.writer: asyncio.StreamWriter | None = None
+        self.sender: protocol.Sender | None = None
+        self.codec: protocol.JsonCodec | protocol.BinaryCodec = protocol.json_codec
         self.run_command = run_command
         self.on_start = on_start
         self.on_end = on_end
-        self.buffers = dict[str, SharedMemory]()
+        self.buffers = SharedBuffers(protocol.segment_prefix(f"c{next(client_ids)}"))
+        self.topologies = dict[tuple[str, str], tuple[int, int, int]]()
+        self.known_meshes = set[str]()
+        self.mesh_offers = dict[
+            int, tuple[Any, Any, tuple[str, str], bool, int, Future[Any]]
+        ]()
+        self.offer_ids = count(1)
+        # the unanswered offer of a path, later meshes for it wait for the answer
+        self.offered = dict[tuple[str, str], Future[Any]]()
+        self.local = threading.local()
+        # set prefer_shared_memory to False to always stream buffers inline
+        self.prefer_shared_memory = True
+        self.shared_memory = True
+        self.compression = 0
+        self.inline = protocol.InlineBuffers()
+        self.inline_ids = count(1)
+        self.request_ids = count(1)
+        self.pending = dict[int, Future[Any]]()
+        # requests sent but not yet answered, send blocks while the window is full
+        self.window = threading.BoundedSemaphore(max_in_flight)
 
-    def start(self, port: int):
+    def start(self, port: int, host: str = "localhost", socket_path: str | None = None):
         if not self.on:
+            if removed := protocol.remove_stale_segments():
+                logger.info("removed %s stale shared memory segments", removed)
             self.on = True
             self.loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self.loop)
-            self.task = self.loop.create_task(self.create_task(port))
+            self.task = self.loop.create_task(self.create_task(port, host, socket_path))
             self.thread = threading.Thread(daemon=False, target=self.func)
             self.thread.start()
 
-    async def create_task(self, port: int):
-        reader, self.writer = await asyncio.open_connection("localhost", port=port)
-        for callback in self.on_start:
-            callback()
-        print("connection started")
+    async def create_task(self, port: int, host: str, socket_path: str | None):
+        if socket_path:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port=port)
+        sender: asyncio.Task[None] | None = None
         try:
+            self.codec = await self.negotiate(reader, writer)
+            self.sender = protocol.Sender()
+            sender = asyncio.create_task(self.sender.run(writer))
+            self.writer = writer
+            for callback in self.on_start:
+                callback()
+            logger.info(
+                "connection started, protocol %s, shared memory %s",
+                self.codec.version,
+                self.shared_memory,
+            )
             while True:
-                data_length = await reader.read(4)
-                if not data_length:
-                    print("connection closed")
-                    break
-                data_length = int.from_bytes(data_length)
-                bin = await reader.read(data_length)
-                if not bin:
-                    print("connection closed")
-                    break
                 try:
-                    data = json.loads(bin.decode())
-                    print(f"received: {data}")
-                except Exception as e:
-                    print(f"unknown data: {e}")
+                    data = await self.codec.read(reader)
+                except protocol.DecodeError as e:
+                    logger.warning(e)
+                    continue
+                if data["id"] == "buffer_chunk":
+                    self.inline.add(**data["params"])
+                    continue
+                if data["id"] == "result":
+                    params = data["params"]
+                    self.resolve(
+                        data.get("request_id", 0), params["error"], params.get("value")
+                    )
                     continue
                 self.run_command(data)
 
+        except asyncio.IncompleteReadError:
+            logger.info("connection closed")
         except asyncio.CancelledError:
-            print("connection canceled")
+            logger.info("connection canceled")
         except ConnectionError:
-            print("connection lost")
+            logger.warning("connection lost")
+        finally:
+            if self.sender:
+                self.sender.close()
+            if sender:
+                sender.cancel()
+            writer.close()
+            await writer.wait_closed()
+            logger.info("connection ended")
+
+    async def negotiate(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> protocol.JsonCodec | protocol.BinaryCodec:
+        # the server maps this segment to find out whether it shares our namespace
+        probe = None
+        if self.prefer_shared_memory:
+            # segment 0 of the client prefix, so a crash never leaves it behind for good
+            name = f"{self.buffers.prefix}0"
+            probe = SharedMemory(name=name, create=True, size=16)
+        try:
+            offer: Any = False
+            if probe:
+                token = uuid4().bytes
+                probe.buf[: len(token)] = token
+                offer = {"name": probe.name, "token": token.hex()}
+            writer.write(
+                protocol.json_codec.encode(protocol.hello(offer, self.compression))
+            )
+            # the server switches codecs with its reply, however late it comes
+            data = await protocol.json_codec.read(reader)
         finally:
-            self.writer.close()
-            await self.writer.wait_closed()
-            print("connection ended")
+            if probe:
+                probe.close()
+                probe.unlink()
+        params = data["params"]
+        self.shared_memory = bool(probe) and params.get("shared_memory", True)
+        return protocol.codecs.get(params["version"], protocol.json_codec)
 
     def func(self):
         assert self.loop is not None and self.task is not None
         try:
             self.loop.run_until_complete(self.task)
         except asyncio.CancelledError:
-            print("client canceled")
+            logger.info("client canceled")
         except ConnectionError:
-            print("server not found")
+            logger.error("server not found")
         finally:
             self.loop.close()
             self.loop = None
             self.task = None
             self.thread = None
             self.writer = None
+            self.sender = None
+            self.codec = protocol.json_codec
+            # the server drops its session state with the connection
+            self.topologies.clear()
+            self.known_meshes.clear()
+            for *_, result in self.mesh_offers.values():
+                if not result.done():
+                    result.set_exception(ConnectionError("connection ended"))
+            self.mesh_offers.clear()
+            self.inline.clear()
+            # the server closed its session, nothing will ack the remaining segments
+            self.buffers.close()
+            self.shared_memory = True
+            pending, self.pending = self.pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("connection ended"))
             self.on = False
             for callback in self.on_end:
                 callback()
-            print("client ended")
+            logger.info("client ended")
 
     def end(self):
-        if self.on:
-            assert (
-                self.loop is not None
-                and self.task is not None
-                and self.thread is not None
-            )
-            self.loop.call_soon_threadsafe(self.task.cancel)
-            self.thread.join()
+        # func resets these fields when the connection ends on its own
+        loop, task, thread = self.loop, self.task, self.thread
+        if not self.on or not loop or not task or not thread:
+            return
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            # the loop closed in between
+            pass
+        thread.join()
 
-    def send(self, data: Any):
-        if not self.writer or not self.loop:
-            print("no connection")
+    @contextmanager
+    def batch(self):
+        if getattr(self.local, "batched", None) is not None:
+            yield
             return
+        self.local.batched = list[Any]()
+        try:
+            yield
+        finally:
+            commands, self.local.batched = self.local.batched, None
+            if commands:
+                future = self.send({"id": "batch", "params": {"commands": commands}})
+                request_ids = [command["request_id"] for command in commands]
+                future.add_done_callback(lambda future: self.abandon(request_ids))
 
-        def send_():
-            if not self.writer:
-                print("no connection")
-                return
-            bin: bytes = json.dumps(data).encode()
-            length = len(bin)
-            self.writer.write(length.to_bytes(length=4))
-            self.writer.write(bin)
-            asyncio.create_task(self.writer.drain())
+    def send_buffer(self, data: memoryview) -> str:
+        name = f"inline/{next(self.inline_ids)}"
+        # chunks skip the batch so they reach the server before the batch uses them
+        for chunk in protocol.buffer_chunks(name, data, self.compression):
+            self.write(chunk)
+        return name
+
+    def send(self, data: Any) -> Future[Any]:
+        future = self.track(data)
+        if (batched := getattr(self.local, "batched", None)) is not None:
+            # the batch takes one window slot for all of its commands
+            batched.append(data)
+            return future
+        # the network thread answers mesh offers, it must never wait for itself
+        if threading.current_thread() is not self.thread:
+            self.window.acquire()
+            future.add_done_callback(lambda _: self.window.release())
+        self.dispatch(data)
+        return future
+
+    async def send_async(self, data: Any) -> Any:
+        # waits for a window slot without blocking the calling event loop
+        if not self.window.acquire(blocking=False):
+            await asyncio.get_running_loop().run_in_executor(None, self.window.acquire)
+        future = self.track(data)
+        future.add_done_callback(lambda _: self.window.release())
+        self.dispatch(data)
+        return await asyncio.wrap_future(future)
+
+    def dispatch(self, data: Any):
+        if not self.write(data):
+            if future := self.pending.pop(data["request_id"], None):
+                future.set_exception(ConnectionError("no connection"))
+
+    def track(self, data: Any) -> Future[Any]:
+        future = Future[Any]()
+        data["request_id"] = next(self.request_ids)
+        self.pending[data["request_id"]] = future
+        return future
+
+    def resolve(self, request_id: int, error: str | None, value: Any = None):
+        if not (future := self.pending.pop(request_id, None)):
+            return
+        if error:
+            future.set_exception(CommandError(error))
+        else:
+            future.set_result(value)
+
+    def abandon(self, request_ids: list[int]):
+        for request_id in request_ids:
+            self.resolve(request_id, "batch did not run")
 
-        self.loop.call_soon_threadsafe(send_)
+    def write(self, data: Any, urgent: bool = False) -> bool:
+        sender = self.sender
+        if not self.writer or not sender:
+            logger.warning("no connection")
+            return False
+        # callers wait while too many bytes are unsent, except the network thread
+        block = threading.current_thread() is not self.thread
+        return sender.put(self.codec.encode(data), block=block, urgent=urgent)
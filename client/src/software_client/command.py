@@ -1,10 +1,44 @@
 from collections.abc import Callable, Iterable
+from concurrent.futures import Future
+from hashlib import blake2b
+import logging
 from pathlib import Path
 from typing import Any
+from software_client import protocol
 from software_client.client import Client
 from multiprocessing.shared_memory import SharedMemory
 from numpy.typing import NDArray
-from numpy import array, copyto, float32, int32, ndarray
+from numpy import (
+    arange,
+    dtype as numpy_dtype,
+    prod,
+    asarray,
+    ascontiguousarray,
+    concatenate,
+    copysign,
+    copyto,
+    cumsum,
+    float32,
+    frombuffer,
+    int32,
+    maximum,
+    ndarray,
+    repeat,
+    sqrt,
+    stack,
+    where,
+)
+from numpy.linalg import norm
+from zlib import crc32
+
+logger = logging.getLogger(__name__)
+
+
+def mesh_hash(positions: NDArray[float], triangles: NDArray[float]) -> str:
+    hash = blake2b(digest_size=16)
+    hash.update(ascontiguousarray(positions, float32))
+    hash.update(ascontiguousarray(triangles, int32))
+    return hash.hexdigest()
 
 
 def create_mesh(
@@ -14,39 +48,186 @@ def create_mesh(
     path: Path,
     file_path: Path,
     sync: bool,
-):
-    positions_shared = create_buffer(client, positions.nbytes)
-    triangles_shared = create_buffer(client, triangles.nbytes)
-    if positions_shared:
-        copyto(
-            ndarray(positions.shape, positions.dtype, positions_shared.buf), positions
+    cache: bool = True,
+) -> Future[Any]:
+    key = (path.as_posix(), file_path.as_posix())
+    if (offered := client.offered.get(key)) is not None:
+        # a miss resends the offered mesh, nothing for the path may overtake it
+        deferred = Future[Any]()
+        held = hold_array(client, positions), hold_array(client, triangles)
+
+        def resume(_: Future[Any]):
+            try:
+                chain(
+                    create_mesh(client, *held, path, file_path, sync, cache), deferred
+                )
+            finally:
+                for array in held:
+                    release_array(client, array)
+
+        offered.add_done_callback(resume)
+        return deferred
+    topology = (
+        len(positions),
+        len(triangles),
+        crc32(ascontiguousarray(triangles, int32)),
+    )
+    # unchanged topology only needs the new positions
+    positions_only = client.topologies.get(key) == topology
+    if positions_only:
+        future = send_mesh(client, positions, None, key, sync, topology[2], None)
+        future.add_done_callback(
+            lambda _: forget_rejected(client, key, topology, future)
+        )
+        return future
+
+    hash = mesh_hash(positions, triangles) if cache else None
+    if hash and hash in client.known_meshes:
+        # offer the hash first, the arrays are only read again on a miss
+        offer = next(client.offer_ids)
+        result = Future[Any]()
+        client.offered[key] = result
+        client.topologies.pop(key, None)
+
+        def answered(result: Future[Any]):
+            # runs before any create_mesh that waited for the offer
+            if client.offered.get(key) is result:
+                del client.offered[key]
+            if not result.exception():
+                client.topologies[key] = topology
+
+        result.add_done_callback(answered)
+        client.mesh_offers[offer] = (
+            hold_array(client, positions),
+            hold_array(client, triangles),
+            key,
+            sync,
+            topology[2],
+            result,
         )
-    if triangles_shared:
-        copyto(
-            ndarray(triangles.shape, triangles.dtype, triangles_shared.buf), triangles
+        link = client.send(
+            {
+                "id": "link_mesh",
+                "params": {
+                    "offer": offer,
+                    "hash": hash,
+                    "path": key[0],
+                    "file_path": key[1],
+                    "sync": sync,
+                    "topology": topology[2],
+                },
+            }
         )
-    client.send(
+
+        # a hit completes with the offer answer, a miss with the mesh sent after it
+        def fail(link: Future[Any]):
+            if not link.exception():
+                return
+            if held := client.mesh_offers.pop(offer, None):
+                release_array(client, held[0])
+                release_array(client, held[1])
+            chain(link, result)
+
+        link.add_done_callback(fail)
+        return result
+    if hash:
+        client.known_meshes.add(hash)
+    client.topologies[key] = topology
+    return send_mesh(client, positions, triangles, key, sync, topology[2], hash)
+
+
+def publish_mesh(
+    client: Client,
+    positions: NDArray[float32],
+    triangles: NDArray[int32],
+    path: Path,
+    file_path: Path,
+    sync: bool,
+) -> Future[Any]:
+    # arrays from allocate_array, filled in place, are sent without any copy,
+    # wait for the future before writing into them again
+    for array, dtype in ((positions, float32), (triangles, int32)):
+        if array.dtype != dtype or array.ndim != 2 or array.shape[1] != 3:
+            raise ValueError(f"expected an (n, 3) {numpy_dtype(dtype)} array")
+        if array.nbytes and shared_name(client, array) is None:
+            raise ValueError("publish_mesh takes arrays from allocate_array")
+    return create_mesh(client, positions, triangles, path, file_path, sync, False)
+
+
+def chain(source: Future[Any], target: Future[Any]):
+    def copy(source: Future[Any]):
+        if target.done():
+            return
+        if error := source.exception():
+            target.set_exception(error)
+        else:
+            target.set_result(source.result())
+
+    source.add_done_callback(copy)
+
+
+def forget_rejected(
+    client: Client,
+    key: tuple[str, str],
+    topology: tuple[int, int, int],
+    future: Future[Any],
+):
+    # the server does not hold this topology, the next create_mesh sends it whole
+    if future.exception() and client.topologies.get(key) == topology:
+        del client.topologies[key]
+
+
+def send_mesh(
+    client: Client,
+    positions: NDArray[float],
+    triangles: NDArray[float] | None,
+    key: tuple[str, str],
+    sync: bool,
+    topology: int,
+    hash: str | None,
+) -> Future[Any]:
+    return client.send(
         {
             "id": "create_mesh",
             "params": {
-                "positions_name": positions_shared.name if positions_shared else "",
-                "triangles_name": triangles_shared.name if triangles_shared else "",
+                "positions_name": share_array(client, positions),
+                "triangles_name": (
+                    "" if triangles is None else share_array(client, triangles)
+                ),
                 "vertices_length": len(positions),
-                "triangles_length": len(triangles),
-                "path": path.as_posix(),
-                "file_path": file_path.as_posix(),
+                "triangles_length": 0 if triangles is None else len(triangles),
+                "path": key[0],
+                "file_path": key[1],
                 "sync": sync,
+                "topology": topology,
+                "positions_only": triangles is None,
+                "hash": hash,
             },
         }
     )
 
+
+def answer_mesh_offer(client: Client, offer: int, hit: bool):
+    positions, triangles, key, sync, topology, result = client.mesh_offers.pop(offer)
+    try:
+        if hit:
+            result.set_result(None)
+            return
+        hash = mesh_hash(positions, triangles)
+        future = send_mesh(client, positions, triangles, key, sync, topology, hash)
+        chain(future, result)
+    finally:
+        release_array(client, positions)
+        release_array(client, triangles)
+
+
 def create_cube(
     client: Client,
     size: float,
     path: Path,
     file_path: Path,
-):
-    client.send(
+) -> Future[Any]:
+    return client.send(
         {
             "id": "create_cube",
             "params": {
@@ -65,8 +246,9 @@ def create_cylinder(
     axis: str,
     path: Path,
     file_path: Path,
-):
-    client.send(
+    segments: int = 32,
+) -> Future[Any]:
+    return client.send(
         {
             "id": "create_cylinder",
             "params": {
@@ -75,11 +257,83 @@ def create_cylinder(
                 "axis": axis,
                 "path": path.as_posix(),
                 "file_path": file_path.as_posix(),
+                "segments": segments,
+            },
+        }
+    )
+
+
+def create_primitive(
+    client: Client,
+    kind: str,
+    dimensions: Iterable[float],
+    path: Path,
+    file_path: Path,
+    axis: str = "Z",
+    segments: int = 32,
+) -> Future[Any]:
+    # the server builds each distinct primitive once and shares its mesh
+    return client.send(
+        {
+            "id": "create_primitive",
+            "params": {
+                "kind": kind,
+                "dimensions": [float(size) for size in dimensions],
+                "path": path.as_posix(),
+                "file_path": file_path.as_posix(),
+                "axis": axis,
+                "segments": segments,
             },
         }
     )
 
 
+def create_plane(
+    client: Client, size: float, path: Path, file_path: Path, axis: str = "Z"
+) -> Future[Any]:
+    return create_primitive(client, "plane", [size], path, file_path, axis)
+
+
+def create_sphere(
+    client: Client,
+    radius: float,
+    path: Path,
+    file_path: Path,
+    axis: str = "Z",
+    segments: int = 32,
+) -> Future[Any]:
+    return create_primitive(client, "sphere", [radius], path, file_path, axis, segments)
+
+
+def create_cone(
+    client: Client,
+    radius1: float,
+    radius2: float,
+    height: float,
+    axis: str,
+    path: Path,
+    file_path: Path,
+    segments: int = 32,
+) -> Future[Any]:
+    return create_primitive(
+        client, "cone", [radius1, radius2, height], path, file_path, axis, segments
+    )
+
+
+def create_capsule(
+    client: Client,
+    radius: float,
+    height: float,
+    axis: str,
+    path: Path,
+    file_path: Path,
+    segments: int = 32,
+) -> Future[Any]:
+    return create_primitive(
+        client, "capsule", [radius, height], path, file_path, axis, segments
+    )
+
+
 def set_xform(
     client: Client,
     translation: NDArray[float],
@@ -88,8 +342,8 @@ def set_xform(
     path: Path,
     file_path: Path,
     sync: bool,
-):
-    client.send(
+) -> Future[Any]:
+    return client.send(
         {
             "id": "set_xform",
             "params": {
@@ -104,20 +358,175 @@ def set_xform(
     )
 
 
-def clear(client: Client):
-    client.send({"id": "clear", "params": None})
+def set_xforms(
+    client: Client,
+    translations: NDArray[float],
+    rotations: NDArray[float],
+    scales: NDArray[float],
+    paths: Iterable[Path],
+    file_path: Path,
+    sync: bool,
+) -> Future[Any]:
+    transforms = concatenate(
+        (
+            asarray(translations, float32).reshape(-1, 3),
+            asarray(rotations, float32).reshape(-1, 4),
+            asarray(scales, float32).reshape(-1, 3),
+        ),
+        axis=1,
+    )
+    return client.send(
+        {
+            "id": "set_xforms",
+            "params": {
+                "transforms": transforms,
+                "paths": [path.as_posix() for path in paths],
+                "file_path": file_path.as_posix(),
+                "sync": sync,
+            },
+        }
+    )
+
+
+def set_matrices(
+    client: Client,
+    matrices: NDArray[float],
+    paths: Iterable[Path],
+    file_path: Path,
+    sync: bool,
+) -> Future[Any]:
+    params = {
+        "paths": [path.as_posix() for path in paths],
+        "file_path": file_path.as_posix(),
+        "sync": sync,
+    }
+    array_param(
+        client, params, "matrices", asarray(matrices, float32).reshape(-1, 4, 4)
+    )
+    return client.send({"id": "set_xforms", "params": params})
+
+
+def create_instances(
+    client: Client,
+    matrices: NDArray[float],
+    path: Path,
+    file_path: Path,
+    source_path: Path | None = None,
+    positions: NDArray[float] | None = None,
+    triangles: NDArray[float] | None = None,
+) -> Future[Any]:
+    matrices = asarray(matrices, float32).reshape(-1, 4, 4)
+    params: dict[str, Any] = {
+        "matrices_length": len(matrices),
+        "path": path.as_posix(),
+        "file_path": file_path.as_posix(),
+    }
+    array_param(client, params, "matrices", matrices)
+    if source_path is not None:
+        params["source_path"] = source_path.as_posix()
+    elif positions is not None and triangles is not None:
+        positions = ascontiguousarray(positions, float32)
+        triangles = ascontiguousarray(triangles, int32)
+        if positions.size and triangles.size:
+            params["positions_name"] = share_array(client, positions)
+            params["triangles_name"] = share_array(client, triangles)
+            params["vertices_length"] = len(positions)
+            params["triangles_length"] = len(triangles)
+    # without a source the existing instances at path just get the new matrices
+    return client.send({"id": "create_instances", "params": params})
+
+
+def clear(
+    client: Client, file_path: Path | None = None, path: Path | None = None
+) -> Future[Any]:
+    if file_path is None and path is None:
+        client.topologies.clear()
+        client.known_meshes.clear()
+        return client.send({"id": "clear", "params": None})
+
+    prefix = path.as_posix() if path is not None else None
+    scope = file_path.as_posix() if file_path is not None else None
+    for key in list(client.topologies):
+        if scope is not None and key[1] != scope:
+            continue
+        if prefix is None or key[0] == prefix or key[0].startswith(prefix + "/"):
+            del client.topologies[key]
+    return client.send(
+        {
+            "id": "clear",
+            "params": {
+                "file_path": scope,
+                "path": prefix,
+            },
+        }
+    )
+
+
+def sync_channels(
+    client: Client, path: Path, file_path: Path, channels: Iterable[str]
+) -> Future[Any]:
+    # opt in to attribute channels on every sync_mesh of the path:
+    # "normal", "uv" or "uv:<layer>", "color" or "color:<attribute>", "material"
+    return client.send(
+        {
+            "id": "sync_channels",
+            "params": {
+                "path": path.as_posix(),
+                "file_path": file_path.as_posix(),
+                "channels": list(channels),
+            },
+        }
+    )
+
+
+def stats(client: Client) -> Future[Any]:
+    # resolves to the server metrics: per command counts and timings, queue and buffers
+    return client.send({"id": "stats", "params": None})
+
 
-def receive_buffer(client: Client, name: str):
-    client.send(
+def receive_buffer(client: Client, name: str, generation: int | None = None):
+    # acks are fire and forget, they neither wait for the window nor get a reply
+    client.write(
         {
             "id": "received_buffer",
             "params": {
                 "name": name,
+                "generation": generation,
             },
-        }
+        },
+        urgent=True,
     )
 
 
+class SharedMemoryMap:
+    def __init__(self, max_mapped: int) -> None:
+        self.max_mapped = max_mapped
+        self.mapped = dict[str, SharedMemory]()
+
+    def map(self, name: str) -> SharedMemory:
+        # the server pools its segments, so the same names come back every sync
+        if shared := self.mapped.pop(name, None):
+            self.mapped[name] = shared
+            return shared
+        shared = protocol.attach(name)
+        self.mapped[name] = shared
+        while len(self.mapped) > self.max_mapped:
+            evicted = self.mapped.pop(next(iter(self.mapped)))
+            try:
+                evicted.close()
+            except BufferError:
+                pass
+        return shared
+
+
+def open_buffer(
+    client: Client, mapped: SharedMemoryMap, name: str
+) -> SharedMemory | protocol.InlineBuffer:
+    if inline := client.inline.pop(name):
+        return inline
+    return mapped.map(name)
+
+
 class Command:
     id: str
     client: Client
@@ -130,9 +539,32 @@ class SyncMesh(Command):
 
     def __init__(
         self,
-        callback: Callable[[NDArray[float32], NDArray[int32], Path, Path, Any], None],
+        callback: (
+            Callable[[NDArray[float32], NDArray[int32], Path, Path, Any], None] | None
+        ) = None,
+        channels_callback: (
+            Callable[
+                [
+                    NDArray[float32],
+                    NDArray[int32],
+                    dict[str, NDArray[Any]],
+                    Path,
+                    Path,
+                    Any,
+                ],
+                None,
+            ]
+            | None
+        ) = None,
+        max_mapped: int = 64,
     ) -> None:
         self.callback = callback
+        # channel arrays are views of the shared buffers, valid during the call only
+        self.channels_callback = channels_callback
+        self.mapped = SharedMemoryMap(max_mapped)
+        self.meshes = dict[
+            tuple[str, str], tuple[int | None, NDArray[int32], NDArray[float32]]
+        ]()
 
     def run(
         self,
@@ -142,68 +574,234 @@ class SyncMesh(Command):
         indices_length: int,
         path: str,
         file_path: Path,
+        generation: int | None = None,
+        topology: int | None = None,
+        ranges_name: str = "",
+        ranges_length: int = 0,
+        channels: list[list[Any]] | None = None,
     ):
-        positions_shared = SharedMemory(name=positions_name)
-        indices_shared = SharedMemory(name=indices_name)
-        positions = ndarray(
-            vertices_length * 3,
-            float32,
-            positions_shared.buf,
-        ).reshape(-1, 3)
-        indices = ndarray(
-            indices_length,
-            int32,
-            indices_shared.buf,
-        )
-        self.callback(
-            positions,
-            indices,
-            Path(path),
-            Path(file_path),
-            (positions_shared, indices_shared),
-        )
-        receive_buffer(self.client, positions_shared.name)
-        receive_buffer(self.client, indices_shared.name)
+        key = (str(path), str(file_path))
+        cached = self.meshes.get(key)
+        shared = [open_buffer(self.client, self.mapped, positions_name)]
+        rows = {
+            "corner": indices_length,
+            "point": vertices_length,
+            "triangle": indices_length // 3,
+        }
+        views = dict[str, NDArray[Any]]()
+        for name, buffer_name, dtype, width, domain in channels or ():
+            channel = open_buffer(self.client, self.mapped, buffer_name)
+            shape = (rows[domain], width) if width > 1 else rows[domain]
+            views[name] = ndarray(shape, numpy_dtype(dtype), channel.buf)
+            # acked with the rest, also when the frame is dropped below
+            shared.append(channel)
+        if indices_name:
+            shared.append(open_buffer(self.client, self.mapped, indices_name))
+            indices = ndarray(indices_length, int32, shared[-1].buf)
+            cached_indices = indices.copy()
+        elif cached and cached[0] == topology:
+            indices = cached_indices = cached[1]
+        else:
+            logger.warning("no cached topology for %s", path)
+            self.release(shared, generation)
+            return
+
+        if not ranges_name:
+            positions = ndarray(
+                vertices_length * 3,
+                float32,
+                shared[0].buf,
+            ).reshape(-1, 3)
+            cached_positions = positions.copy()
+        elif cached:
+            # sparse delta: scatter the moved vertex ranges into the cached positions
+            shared.append(open_buffer(self.client, self.mapped, ranges_name))
+            ranges = ndarray((ranges_length, 2), int32, shared[-1].buf)
+            lengths = ranges[:, 1] - ranges[:, 0]
+            changed_length = int(lengths.sum())
+            changed = ndarray((changed_length, 3), float32, shared[0].buf)
+            offsets = cumsum(lengths) - lengths
+            index = arange(changed_length) + repeat(ranges[:, 0] - offsets, lengths)
+            positions = cached_positions = cached[2]
+            positions[index] = changed
+        else:
+            logger.warning("no cached positions for %s", path)
+            self.release(shared, generation)
+            return
+
+        self.meshes[key] = (topology, cached_indices, cached_positions)
+        if self.channels_callback:
+            self.channels_callback(
+                positions,
+                indices,
+                views,
+                Path(path),
+                Path(file_path),
+                tuple(shared),
+            )
+        elif self.callback:
+            self.callback(
+                positions,
+                indices,
+                Path(path),
+                Path(file_path),
+                tuple(shared),
+            )
+        self.release(shared, generation)
+
+    def release(
+        self,
+        shared: list[SharedMemory | protocol.InlineBuffer],
+        generation: int | None,
+    ):
+        for buffer in shared:
+            # inline buffers were never pooled on the server
+            if isinstance(buffer, SharedMemory):
+                receive_buffer(self.client, buffer.name, generation)
+
+
+def decompose(
+    matrices: NDArray[float32],
+) -> tuple[NDArray[float32], NDArray[float32], NDArray[float32]]:
+    translations = matrices[:, :3, 3]
+    scales = norm(matrices[:, :3, :3], axis=1)
+    m = matrices[:, :3, :3] / where(scales == 0, 1, scales)[:, None, :]
+    trace = (
+        (1 + m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]),
+        (1 + m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2]),
+        (1 - m[:, 0, 0] + m[:, 1, 1] - m[:, 2, 2]),
+        (1 - m[:, 0, 0] - m[:, 1, 1] + m[:, 2, 2]),
+    )
+    w, x, y, z = (sqrt(maximum(0, t)) / 2 for t in trace)
+    rotations = stack(
+        (
+            copysign(x, m[:, 2, 1] - m[:, 1, 2]),
+            copysign(y, m[:, 0, 2] - m[:, 2, 0]),
+            copysign(z, m[:, 1, 0] - m[:, 0, 1]),
+            w,
+        ),
+        axis=1,
+    )
+    return translations, rotations, scales
+
 
 class SyncXform(Command):
-    id = "sync_xform"
+    id = "sync_xforms"
 
     def __init__(
         self,
-        callback: Callable[
-            [NDArray[float], NDArray[float], NDArray[float], Path, Path], None
-        ],
+        callback: (
+            Callable[[NDArray[float], NDArray[float], NDArray[float], Path, Path], None]
+            | None
+        ) = None,
+        matrices_callback: (
+            Callable[[NDArray[float32], list[tuple[Path, Path]], Any], None] | None
+        ) = None,
+        max_mapped: int = 8,
     ) -> None:
         self.callback = callback
+        self.matrices_callback = matrices_callback
+        self.mapped = SharedMemoryMap(max_mapped)
+        self.paths = list[tuple[Path, Path]]()
+        self.slots_version: int | None = None
 
     def run(
         self,
-        translation: tuple[float, ...],
-        rotation: tuple[float, ...],
-        scale: tuple[float, ...],
-        path: str,
-        file_path: Path,
+        name: str,
+        generation: int,
+        length: int,
+        slots_version: int,
+        paths: list[tuple[str, str]] | None,
     ):
-        self.callback(
-            array(translation),
-            array(rotation),
-            array(scale),
-            Path(path),
-            Path(file_path),
-        )
+        if paths is not None:
+            self.paths = [(Path(path), Path(file_path)) for path, file_path in paths]
+            self.slots_version = slots_version
+        shared = open_buffer(self.client, self.mapped, name)
+        if self.slots_version != slots_version:
+            logger.warning("unknown transform slots version %s", slots_version)
+        else:
+            # world matrices, row major, one per slot
+            matrices = ndarray((length, 4, 4), float32, shared.buf)
+            if self.matrices_callback:
+                self.matrices_callback(matrices, self.paths, shared)
+            if self.callback:
+                translations, rotations, scales = decompose(matrices)
+                for (path, file_path), translation, rotation, scale in zip(
+                    self.paths, translations, rotations, scales
+                ):
+                    self.callback(translation, rotation, scale, path, file_path)
+        if isinstance(shared, SharedMemory):
+            receive_buffer(self.client, name, generation)
+
+
+def allocate_array(client: Client, shape: Any, dtype: Any) -> NDArray[Any]:
+    # a pooled shared memory array the producer fills in place, commands given
+    # this array send its segment name instead of copying it
+    length = int(prod(shape))
+    shared = client.buffers.create(max(length * numpy_dtype(dtype).itemsize, 1))
+    # frombuffer holds the buffer export, so the segment is never unmapped under it
+    return frombuffer(shared.buf, dtype, length).reshape(shape)
+
+
+def release_array(client: Client, array: NDArray[Any]):
+    # the segment returns to the pool once the server acked every command using it
+    if name := shared_name(client, array):
+        client.buffers.release(name)
+
+
+def shared_name(client: Client, array: NDArray[Any]) -> str | None:
+    if not array.flags.c_contiguous:
+        return None
+    return client.buffers.find(array.__array_interface__["data"][0], array.nbytes)
+
+
+def array_param(client: Client, params: dict[str, Any], key: str, array: NDArray[Any]):
+    # arrays already in shared memory travel by name, others inside the frame
+    if client.shared_memory and (name := shared_name(client, array)):
+        client.buffers.retain(name)
+        params[f"{key}_name"] = name
+    else:
+        params[key] = array
+
+
+def share_array(client: Client, array: NDArray[Any]) -> str:
+    if not array.nbytes:
+        return ""
+    if not client.shared_memory:
+        return client.send_buffer(ascontiguousarray(array).data)
+    if name := shared_name(client, array):
+        client.buffers.retain(name)
+        return name
+    shared = create_buffer(client, array.nbytes)
+    assert shared
+    copyto(ndarray(array.shape, array.dtype, shared.buf), array)
+    return shared.name
+
+
+def hold_array(client: Client, array: NDArray[Any]) -> NDArray[Any]:
+    # a copy for meshes sent later, the producer may reuse its array once the call
+    # returns, release_array frees it again
+    if not client.shared_memory or not array.nbytes:
+        return array.copy()
+    if name := shared_name(client, array):
+        client.buffers.retain(name)
+        return array
+    shared = create_buffer(client, array.nbytes)
+    assert shared
+    held = ndarray(array.shape, array.dtype, shared.buf)
+    copyto(held, array)
+    return held
 
 
 def create_buffer(client: Client, size: int) -> SharedMemory | None:
     if size > 0:
-        ret = SharedMemory(create=True, size=size)
-        client.buffers[ret.name] = ret
-        return ret
+        return client.buffers.create(size)
     else:
         return None
 
 
 def release_buffer(client: Client, name: str):
-    assert client.buffers.pop(name)
+    client.buffers.release(name)
 
 
 class RunCommands:
@@ -215,9 +813,11 @@ class RunCommands:
         id = data["id"]
         params = data["params"]
         if id == "received_buffer":
-            release_buffer(**params)
+            release_buffer(self.client, **params)
+        elif id == "mesh_offer":
+            answer_mesh_offer(self.client, **params)
         elif command := self.commands.get(id):
             command.client = self.client
             command.run(**params)
         else:
-            print(f"unknown command id: {id}")
+            logger.warning("unknown command id: %s", id)
@@ -0,0 +1,551 @@
+# shared by the add-on and the client, tests/test_protocol.py keeps both identical
+from __future__ import annotations
+
+from asyncio import (
+    AbstractEventLoop,
+    Event,
+    StreamReader,
+    StreamWriter,
+    get_running_loop,
+)
+from base64 import b64decode, b64encode
+from collections import deque
+from collections.abc import Callable, Hashable, Iterator
+import json
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import os
+import re
+from struct import Struct
+import sys
+import threading
+from typing import Any
+import zlib
+
+from numpy import ascontiguousarray, dtype, frombuffer, ndarray
+
+VERSION = 1
+JSON_VERSION = 0
+
+# version, message type, flags, request id, payload length
+header = Struct("<BBHII")
+json_length = Struct(">I")
+
+# message type = index + 1, type 0 carries the id inside the payload
+message_ids = (
+    "hello",
+    "create_mesh",
+    "create_cube",
+    "create_cylinder",
+    "clear",
+    "set_xform",
+    "received_buffer",
+    "sync_mesh",
+    "sync_xform",
+    "batch",
+    "set_xforms",
+    "sync_xforms",
+    "link_mesh",
+    "mesh_offer",
+    "create_instances",
+    "buffer_chunk",
+    "result",
+    "stats",
+    "sync_channels",
+    "create_primitive",
+)
+message_types = dict((id, index + 1) for index, id in enumerate(message_ids))
+
+NONE = 0
+FALSE = 1
+TRUE = 2
+INT = 3
+FLOAT = 4
+STR = 5
+BYTES = 6
+LIST = 7
+DICT = 8
+ARRAY = 9
+FLOATS = 10
+
+tag = Struct("<B")
+int64 = Struct("<q")
+float64 = Struct("<d")
+uint32 = Struct("<I")
+
+
+class DecodeError(Exception):
+    def __init__(self, bin: bytes) -> None:
+        super().__init__(f"unknown data: {bin[:64]!r}")
+        self.bin = bin
+
+
+def encode_value(value: Any, out: list[bytes]):
+    if value is None:
+        out.append(tag.pack(NONE))
+    elif value is True:
+        out.append(tag.pack(TRUE))
+    elif value is False:
+        out.append(tag.pack(FALSE))
+    elif isinstance(value, int):
+        out.append(tag.pack(INT) + int64.pack(value))
+    elif isinstance(value, float):
+        out.append(tag.pack(FLOAT) + float64.pack(value))
+    elif isinstance(value, str):
+        bin = value.encode()
+        out.append(tag.pack(STR) + uint32.pack(len(bin)))
+        out.append(bin)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(tag.pack(BYTES) + uint32.pack(len(value)))
+        out.append(bytes(value))
+    elif isinstance(value, ndarray):
+        value = ascontiguousarray(value, value.dtype.newbyteorder("<"))
+        dtype_bin = value.dtype.str.encode()
+        out.append(tag.pack(ARRAY) + tag.pack(len(dtype_bin)) + dtype_bin)
+        out.append(tag.pack(value.ndim) + b"".join(uint32.pack(n) for n in value.shape))
+        out.append(value.tobytes())
+    elif isinstance(value, (list, tuple)):
+        if value and all(type(item) is float for item in value):
+            out.append(tag.pack(FLOATS) + uint32.pack(len(value)))
+            out.append(Struct(f"<{len(value)}d").pack(*value))
+        else:
+            out.append(tag.pack(LIST) + uint32.pack(len(value)))
+            for item in value:
+                encode_value(item, out)
+    elif isinstance(value, dict):
+        out.append(tag.pack(DICT) + uint32.pack(len(value)))
+        for key, item in value.items():
+            bin = str(key).encode()
+            out.append(uint32.pack(len(bin)))
+            out.append(bin)
+            encode_value(item, out)
+    else:
+        raise TypeError(f"can not encode {type(value)}")
+
+
+def decode_value(bin: bytes, offset: int) -> tuple[Any, int]:
+    kind = bin[offset]
+    offset += 1
+    match kind:
+        case 0:
+            return None, offset
+        case 1:
+            return False, offset
+        case 2:
+            return True, offset
+        case 3:
+            return int64.unpack_from(bin, offset)[0], offset + 8
+        case 4:
+            return float64.unpack_from(bin, offset)[0], offset + 8
+        case 5:
+            (length,) = uint32.unpack_from(bin, offset)
+            offset += 4
+            return bin[offset : offset + length].decode(), offset + length
+        case 6:
+            (length,) = uint32.unpack_from(bin, offset)
+            offset += 4
+            return bin[offset : offset + length], offset + length
+        case 7:
+            (length,) = uint32.unpack_from(bin, offset)
+            offset += 4
+            items = []
+            for _ in range(length):
+                item, offset = decode_value(bin, offset)
+                items.append(item)
+            return items, offset
+        case 8:
+            (length,) = uint32.unpack_from(bin, offset)
+            offset += 4
+            items = {}
+            for _ in range(length):
+                (key_length,) = uint32.unpack_from(bin, offset)
+                offset += 4
+                key = bin[offset : offset + key_length].decode()
+                offset += key_length
+                items[key], offset = decode_value(bin, offset)
+            return items, offset
+        case 9:
+            dtype_length = bin[offset]
+            offset += 1
+            array_dtype = dtype(bin[offset : offset + dtype_length].decode())
+            offset += dtype_length
+            ndim = bin[offset]
+            offset += 1
+            shape = Struct(f"<{ndim}I").unpack_from(bin, offset)
+            offset += 4 * ndim
+            count = 1
+            for n in shape:
+                count *= n
+            array = frombuffer(bin, array_dtype, count, offset).reshape(shape)
+            return array, offset + array.nbytes
+        case 10:
+            (length,) = uint32.unpack_from(bin, offset)
+            offset += 4
+            items = list(Struct(f"<{length}d").unpack_from(bin, offset))
+            return items, offset + 8 * length
+        case _:
+            raise ValueError(f"unknown tag {kind}")
+
+
+def json_default(value: Any) -> Any:
+    if isinstance(value, ndarray):
+        return value.tolist()
+    if isinstance(value, bytes):
+        return b64encode(value).decode()
+    raise TypeError(f"can not encode {type(value)}")
+
+
+class JsonCodec:
+    version = JSON_VERSION
+
+    def encode(self, data: Any) -> bytes:
+        bin = json.dumps(data, default=json_default).encode()
+        return json_length.pack(len(bin)) + bin
+
+    async def read_frame(self, reader: StreamReader) -> tuple[bytes, bytes]:
+        head = await reader.readexactly(json_length.size)
+        (length,) = json_length.unpack(head)
+        return head, await reader.readexactly(length)
+
+    def decode(self, head: bytes, bin: bytes) -> Any:
+        try:
+            return json.loads(bin.decode())
+        except Exception as e:
+            raise DecodeError(bin) from e
+
+    async def read(self, reader: StreamReader) -> Any:
+        return self.decode(*await self.read_frame(reader))
+
+
+class BinaryCodec:
+    version = VERSION
+
+    def encode(self, data: Any) -> bytes:
+        id: str = data["id"]
+        out: list[bytes] = []
+        if message_type := message_types.get(id):
+            encode_value(data["params"], out)
+        else:
+            message_type = 0
+            encode_value({"id": id, "params": data["params"]}, out)
+        payload = b"".join(out)
+        request_id = data.get("request_id", 0)
+        return header.pack(VERSION, message_type, 0, request_id, len(payload)) + payload
+
+    async def read_frame(self, reader: StreamReader) -> tuple[bytes, bytes]:
+        head = await reader.readexactly(header.size)
+        length = header.unpack(head)[4]
+        return head, await reader.readexactly(length)
+
+    def decode(self, head: bytes, bin: bytes) -> Any:
+        version, message_type, _, request_id, _ = header.unpack(head)
+        try:
+            if version != VERSION:
+                raise ValueError(f"unknown version {version}")
+            value, _ = decode_value(bin, 0)
+            if message_type:
+                data = {"id": message_ids[message_type - 1], "params": value}
+            else:
+                data = value
+        except Exception as e:
+            raise DecodeError(bin) from e
+        if request_id:
+            data["request_id"] = request_id
+        return data
+
+    async def read(self, reader: StreamReader) -> Any:
+        return self.decode(*await self.read_frame(reader))
+
+
+codecs = {JSON_VERSION: JsonCodec(), VERSION: BinaryCodec()}
+json_codec = codecs[JSON_VERSION]
+
+
+def hello(probe: Any = None, compression: int = 0) -> Any:
+    return {
+        "id": "hello",
+        "params": {
+            "versions": sorted(codecs, reverse=True),
+            "shared_memory": probe,
+            "compression": compression,
+        },
+    }
+
+
+def select_codec(params: Any) -> JsonCodec | BinaryCodec:
+    versions = [version for version in params["versions"] if version in codecs]
+    return codecs[max(versions, default=JSON_VERSION)]
+
+
+def probe_shared_memory(probe: Any) -> bool:
+    # older clients send no probe and only speak shared memory
+    if probe is None:
+        return True
+    if not probe:
+        return False
+    try:
+        shared = attach(probe["name"])
+    except (OSError, ValueError):
+        return False
+    try:
+        token = bytes.fromhex(probe["token"])
+        # a different namespace can reuse the name, so check the content too
+        return bytes(shared.buf[: len(token)]) == token
+    finally:
+        shared.close()
+
+
+def pid_namespace() -> str:
+    # a container sharing /dev/shm has pids of its own, they mean nothing here
+    try:
+        link = os.readlink("/proc/self/ns/pid")
+    except OSError:
+        return "0"
+    return format(int(link[link.index("[") + 1 : -1]), "x")
+
+
+# segment names carry the pid namespace and id of the creating process, so
+# segments left behind by a crashed process can be told apart from live ones,
+# macOS allows 31 characters
+segment_pattern = re.compile(r"ss([0-9a-f]+)-(\d+)[a-z]\d*_\d+")
+shm_dir = "/dev/shm"
+namespace = pid_namespace()
+
+
+def segment_prefix(owner: str) -> str:
+    return f"ss{namespace}-{os.getpid()}{owner}_"
+
+
+def created_here(name: str) -> bool:
+    match = segment_pattern.fullmatch(name)
+    return bool(match) and match[1] == namespace and int(match[2]) == os.getpid()
+
+
+def attach(name: str) -> SharedMemory:
+    # the peer owns the segment, the resource tracker must not unlink it at exit
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    shared = SharedMemory(name=name)
+    # segments of this very process are still registered by their creator
+    if os.name == "posix" and not created_here(name):
+        resource_tracker.unregister(shared._name, "shared_memory")  # type: ignore
+    return shared
+
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_stale_segments() -> int:
+    # only linux lists segments as files, elsewhere they die with their process
+    if not os.path.isdir(shm_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(shm_dir):
+        match = segment_pattern.fullmatch(name)
+        # pids of other namespaces can not be checked, their segments stay
+        if not match or match[1] != namespace or alive(int(match[2])):
+            continue
+        try:
+            os.unlink(os.path.join(shm_dir, name))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+# largest inline payload per frame, so one big buffer does not hold up other messages
+chunk_size = 1 << 20
+
+
+def buffer_chunks(
+    name: str, data: memoryview, compression: int = 0
+) -> Iterator[dict[str, Any]]:
+    data = memoryview(data).cast("B")
+    length = data.nbytes
+    for offset in range(0, max(length, 1), chunk_size):
+        chunk = bytes(data[offset : offset + chunk_size])
+        compressed = False
+        if compression:
+            packed = zlib.compress(chunk, compression)
+            if len(packed) < len(chunk):
+                chunk, compressed = packed, True
+        yield {
+            "id": "buffer_chunk",
+            "params": {
+                "name": name,
+                "offset": offset,
+                "length": length,
+                "data": chunk,
+                "compressed": compressed,
+            },
+        }
+
+
+# a buffer streamed over the socket, read like a SharedMemory segment
+class InlineBuffer:
+    def __init__(self, name: str, buf: bytearray) -> None:
+        self.name = name
+        self.buf = memoryview(buf)
+
+    def close(self):
+        pass
+
+
+class InlineBuffers:
+    def __init__(self) -> None:
+        self.partial = dict[str, tuple[bytearray, int]]()
+        self.ready = dict[str, InlineBuffer]()
+
+    def add(
+        self,
+        name: str,
+        offset: int,
+        length: int,
+        data: bytes | str,
+        compressed: bool,
+    ):
+        if isinstance(data, str):
+            data = b64decode(data)
+        if compressed:
+            data = zlib.decompress(data)
+        buf, received = self.partial.pop(name, (bytearray(length), 0))
+        buf[offset : offset + len(data)] = data
+        received += len(data)
+        if received >= length:
+            self.ready[name] = InlineBuffer(name, buf)
+        else:
+            self.partial[name] = (buf, received)
+
+    def pop(self, name: str) -> InlineBuffer | None:
+        return self.ready.pop(name, None)
+
+    def clear(self):
+        self.partial.clear()
+        self.ready.clear()
+
+
+class Sender:
+    def __init__(self, limit: int = 64 << 20) -> None:
+        # bytes queued or written but not yet drained to the socket
+        self.limit = limit
+        self.bytes = 0
+        self.frames = deque[list[Any]]()
+        # results and acks, written ahead of the ordered frames and buffer chunks
+        self.urgent = deque[list[Any]]()
+        self.keyed = dict[Hashable, list[list[Any]]]()
+        self.dropped = 0
+        self.coalesced = 0
+        self.condition = threading.Condition()
+        self.loop: AbstractEventLoop | None = None
+        self.wake: Event | None = None
+        self.signaled = False
+        self.closed = False
+
+    @property
+    def depth(self) -> int:
+        return len(self.frames) + len(self.urgent)
+
+    @property
+    def congested(self) -> bool:
+        return self.bytes >= self.limit
+
+    def put(
+        self,
+        frame: bytes,
+        key: Hashable = None,
+        supersedes: bool = False,
+        droppable: bool = False,
+        on_drop: Callable[[], None] | None = None,
+        block: bool = False,
+        urgent: bool = False,
+    ) -> bool:
+        dropped = list[Callable[[], None]]()
+        with self.condition:
+            while block and self.congested and not self.closed:
+                self.condition.wait()
+            if self.closed or (droppable and self.congested):
+                self.dropped += 1
+                sent = False
+            else:
+                if supersedes:
+                    # last write wins, older frames for the key are never written
+                    for slot in self.keyed.pop(key, ()):
+                        if slot[0] is not None:
+                            self.bytes -= len(slot[0])
+                            slot[0] = None
+                            self.coalesced += 1
+                            if slot[1]:
+                                dropped.append(slot[1])
+                slot = [frame, on_drop, key]
+                (self.urgent if urgent else self.frames).append(slot)
+                if key is not None:
+                    self.keyed.setdefault(key, []).append(slot)
+                self.bytes += len(frame)
+                sent = True
+                if self.loop and self.wake and not self.signaled:
+                    self.signaled = True
+                    self.loop.call_soon_threadsafe(self.wake.set)
+        for callback in dropped:
+            callback()
+        if not sent and on_drop:
+            on_drop()
+        return sent
+
+    async def run(self, writer: StreamWriter):
+        with self.condition:
+            self.loop = get_running_loop()
+            self.wake = Event()
+        while True:
+            with self.condition:
+                slots = self.take()
+                self.signaled = bool(slots)
+            if not slots:
+                await self.wake.wait()
+                self.wake.clear()
+                continue
+            frames = [slot[0] for slot in slots if slot[0] is not None]
+            size = sum(len(frame) for frame in frames)
+            # one writelines per wake up instead of one write and drain per frame
+            writer.writelines(frames)
+            try:
+                await writer.drain()
+            except ConnectionError:
+                # the reader side notices the lost peer and ends the connection
+                self.close()
+                return
+            with self.condition:
+                self.bytes = max(0, self.bytes - size)
+                self.condition.notify_all()
+
+    def take(self) -> list[list[Any]]:
+        # ordered frames go out about a chunk per round, so urgent frames queued
+        # meanwhile are written between the chunks of a large buffer
+        slots, self.urgent = list(self.urgent), deque()
+        size = 0
+        while self.frames and size < chunk_size:
+            slot = self.frames.popleft()
+            slots.append(slot)
+            size += len(slot[0]) if slot[0] is not None else 0
+        for slot in slots:
+            # a frame taken for writing can no longer be superseded
+            if (key := slot[2]) is not None and (keyed := self.keyed.get(key)):
+                keyed[:] = [each for each in keyed if each is not slot]
+                if not keyed:
+                    del self.keyed[key]
+        return slots
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.urgent.clear()
+            self.frames.clear()
+            self.keyed.clear()
+            self.bytes = 0
+            self.condition.notify_all()
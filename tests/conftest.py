@@ -0,0 +1,63 @@
+from pathlib import Path
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+root = Path(__file__).resolve().parent.parent
+# the stand-in bpy from the benchmark lets the server run without blender
+sys.path[:0] = [
+    str(root / "benchmark" / "fake_blender"),
+    str(root),
+    str(root / "client" / "src"),
+]
+
+import bpy  # noqa: E402
+
+from blender_server import command, server_  # noqa: E402
+from software_client import Client  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def server():
+    root_collection = bpy.data.collections.new("Server")
+    command.collection_name = root_collection.name
+    port = free_port()
+    server = server_.Server(command.run, command.sync_start, command.sync_end)
+    server.start(port, host="127.0.0.1")
+    stop = threading.Event()
+
+    def pump():
+        # the main thread of blender, commands and syncs run here
+        while not stop.is_set():
+            time.sleep(command.drain() or 0.002)
+
+    thread = threading.Thread(target=pump)
+    thread.start()
+    time.sleep(0.2)
+    try:
+        yield port
+    finally:
+        server.end()
+        stop.set()
+        thread.join()
+        command.end_sessions()
+
+
+def connected(client: Client):
+    deadline = time.time() + 5
+    while not client.sender:
+        assert time.time() < deadline, "client did not connect"
+        time.sleep(0.01)
+
+
+def sync_soon():
+    command.queue.push(command.sync_all)
@@ -0,0 +1,35 @@
+from pathlib import Path
+import time
+
+import bpy
+import pytest
+
+from blender_server import command, protocol
+from software_client import Client, RunCommands, create_cube
+
+from conftest import connected
+
+
+def test_late_hello_reply_keeps_codecs_in_step(
+    server: int, monkeypatch: pytest.MonkeyPatch
+):
+    probe = protocol.probe_shared_memory
+
+    def slow_probe(offer):
+        # the network thread of a busy blender answers long after the client asked
+        time.sleep(1.5)
+        return probe(offer)
+
+    monkeypatch.setattr(protocol, "probe_shared_memory", slow_probe)
+    client = Client(lambda data: commands.run(data), [], [])
+    commands = RunCommands([], client)
+    client.start(server, host="127.0.0.1")
+    try:
+        connected(client)
+        (active,) = command.sessions.values()
+        assert client.codec.version == active.connection.codec.version
+        create_cube(client, 1, Path("a"), Path("f")).result(10)
+        obj = active.index.get(Path("a"), Path("f"))
+        assert obj and obj.name in bpy.data.objects
+    finally:
+        client.end()
@@ -0,0 +1,141 @@
+import asyncio
+import os
+from pathlib import Path
+import shlex
+import subprocess
+import sys
+import threading
+
+from numpy import array, float32, int32
+import pytest
+
+from blender_server import protocol
+from software_client import Client, RunCommands, SyncMesh, create_mesh
+from software_client import protocol as client_protocol
+
+from conftest import connected, sync_soon
+
+root = Path(__file__).resolve().parent.parent
+
+positions = array(((0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)), float32)
+triangles = array(((0, 1, 2), (0, 2, 3)), int32)
+
+# runs in another ipc and mount namespace with its own /dev/shm, like a container
+client_script = """
+import sys, threading, time
+from pathlib import Path
+from numpy import array, float32, int32
+from software_client import Client, RunCommands, SyncMesh, create_mesh, protocol
+
+arrived = threading.Event()
+inline = []
+
+def on_mesh(positions, indices, path, file_path, shared):
+    inline.extend(isinstance(each, protocol.InlineBuffer) for each in shared)
+    arrived.set()
+
+client = Client(lambda data: commands.run(data), [], [])
+commands = RunCommands([SyncMesh(on_mesh)], client)
+client.start(int(sys.argv[1]), host="127.0.0.1")
+while not client.sender:
+    time.sleep(0.01)
+positions = array(((0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)), float32)
+triangles = array(((0, 1, 2), (0, 2, 3)), int32)
+create_mesh(client, positions, triangles, Path("a"), Path("f"), True, False).result(10)
+print("ready", client.shared_memory, flush=True)
+ok = arrived.wait(10)
+client.end()
+print("synced", ok, all(inline) and bool(inline), flush=True)
+"""
+
+
+def isolated(args: list[str]) -> list[str]:
+    mount = "mount -t tmpfs tmpfs /dev/shm && exec " + shlex.join(args)
+    return [
+        "unshare",
+        "--ipc",
+        "--mount",
+        "--propagation",
+        "private",
+        "sh",
+        "-c",
+        mount,
+    ]
+
+
+def test_separate_namespace_streams_buffers_inline(server: int):
+    if subprocess.run(isolated(["true"]), capture_output=True).returncode:
+        pytest.skip("can not create ipc and mount namespaces here")
+    env = dict(os.environ, PYTHONPATH=str(root / "client" / "src"))
+    process = subprocess.Popen(
+        isolated([sys.executable, "-c", client_script, str(server)]),
+        stdout=subprocess.PIPE,
+        text=True,
+        env=env,
+    )
+    assert process.stdout
+    assert process.stdout.readline().split() == ["ready", "False"]
+    sync_soon()
+    output, _ = process.communicate(timeout=20)
+    assert output.split() == ["synced", "True", "True"]
+
+
+def test_failed_probe_streams_buffers_inline(
+    server: int, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(protocol, "probe_shared_memory", lambda probe: False)
+    arrived = threading.Event()
+    shared = []
+
+    def on_mesh(positions, indices, path, file_path, buffers):
+        shared.extend(buffers)
+        arrived.set()
+
+    client = Client(lambda data: commands.run(data), [], [])
+    commands = RunCommands([SyncMesh(on_mesh)], client)
+    client.start(server, host="127.0.0.1")
+    try:
+        connected(client)
+        create_mesh(
+            client, positions, triangles, Path("a"), Path("f"), True, False
+        ).result(10)
+        assert not client.shared_memory
+        sync_soon()
+        assert arrived.wait(10)
+        assert shared and all(
+            isinstance(each, client_protocol.InlineBuffer) for each in shared
+        )
+    finally:
+        client.end()
+
+
+class Writer:
+    def __init__(self) -> None:
+        self.rounds = list[list[bytes]]()
+
+    def writelines(self, frames: list[bytes]):
+        self.rounds.append(list(frames))
+
+    async def drain(self):
+        await asyncio.sleep(0)
+
+
+def test_urgent_frames_pass_buffer_chunks():
+    sender = protocol.Sender()
+    writer = Writer()
+    chunk = bytes(protocol.chunk_size)
+
+    async def run():
+        task = asyncio.create_task(sender.run(writer))
+        for _ in range(8):
+            sender.put(chunk)
+        await asyncio.sleep(0)
+        sender.put(b"result", urgent=True)
+        while sum(len(frames) for frames in writer.rounds) < 9:
+            await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(run())
+    frames = [frame for frames in writer.rounds for frame in frames]
+    # the result goes out after at most a couple of chunks, not behind all eight
+    assert frames.index(b"result") <= 2
@@ -0,0 +1,75 @@
+from pathlib import Path
+
+import bpy
+from numpy import array, empty, eye, float32, int32
+from numpy.testing import assert_array_equal
+
+from blender_server import command
+from software_client import Client, RunCommands, clear, create_instances, create_mesh
+
+from conftest import connected
+
+triangles = array(((0, 1, 2), (0, 2, 3)), int32)
+
+
+def vertices(path: Path) -> list[list[float]]:
+    (active,) = command.sessions.values()
+    obj = active.index.get(path, Path("f"))
+    assert obj
+    positions = empty((len(obj.data.vertices), 3), float32)
+    obj.data.vertices.foreach_get("co", positions.ravel())
+    return positions.tolist()
+
+
+def test_reused_arrays_do_not_change_offered_meshes(server: int):
+    client = Client(lambda data: commands.run(data), [], [])
+    commands = RunCommands([], client)
+    client.start(server, host="127.0.0.1")
+    try:
+        connected(client)
+        first = array(((0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)), float32)
+        second = first + 1
+        expected_first, expected_second = first.tolist(), second.tolist()
+        create_mesh(client, first, triangles, Path("a"), Path("f"), False).result(10)
+        clear(client, Path("f"), Path("a")).result(10)
+
+        # the server dropped the mesh, the offer misses and the arrays are sent later
+        future = create_mesh(client, first, triangles, Path("a"), Path("f"), False)
+        first[:] = 99
+        future.result(10)
+        assert_array_equal(vertices(Path("a")), expected_first)
+
+        first[:] = expected_first
+        clear(client, Path("f"), Path("a")).result(10)
+        create_mesh(client, first, triangles, Path("a"), Path("f"), False)
+        # waits behind the open offer of the same path
+        future = create_mesh(client, second, triangles, Path("a"), Path("f"), False)
+        second[:] = 99
+        future.result(10)
+        assert_array_equal(vertices(Path("a")), expected_second)
+    finally:
+        client.end()
+
+
+def test_replaced_instance_meshes_are_removed(server: int):
+    client = Client(lambda data: commands.run(data), [], [])
+    commands = RunCommands([], client)
+    client.start(server, host="127.0.0.1")
+    try:
+        connected(client)
+        before = set(bpy.data.meshes.keys())
+        positions = array(((0, 0, 0), (1, 0, 0), (1, 1, 0)), float32)
+        matrices = eye(4, dtype=float32)[None].repeat(3, axis=0)
+        for offset in range(2):
+            create_instances(
+                client,
+                matrices,
+                Path("a"),
+                Path("f"),
+                positions=positions + offset,
+                triangles=triangles[:1],
+            ).result(10)
+        clear(client).result(10)
+        assert set(bpy.data.meshes.keys()) == before
+    finally:
+        client.end()
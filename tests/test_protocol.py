@@ -0,0 +1,12 @@
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+
+
+def test_protocol_copies_match():
+    server = root / "blender_server" / "protocol.py"
+    client = root / "client" / "src" / "software_client" / "protocol.py"
+    assert server.read_bytes() == client.read_bytes(), (
+        "blender_server/protocol.py and software_client/protocol.py differ, "
+        "edit one and copy it over the other"
+    )
@@ -0,0 +1,51 @@
+from pathlib import Path
+import socket
+import stat
+import time
+
+import pytest
+
+from blender_server import command, server_
+
+
+def unix_server() -> server_.Server:
+    return server_.Server(command.run, command.sync_start, command.sync_end)
+
+
+def test_socket_path_keeps_regular_files(tmp_path: Path):
+    path = tmp_path / "notes.txt"
+    path.write_text("keep")
+    with pytest.raises(FileExistsError):
+        unix_server().start(0, socket_path=str(path))
+    assert path.read_text() == "keep"
+
+
+def test_socket_path_keeps_a_listening_server(tmp_path: Path):
+    path = str(tmp_path / "server.sock")
+    with socket.socket(socket.AF_UNIX) as listening:
+        listening.bind(path)
+        listening.listen()
+        with pytest.raises(FileExistsError):
+            unix_server().start(0, socket_path=path)
+        # the first server is still reachable
+        with socket.socket(socket.AF_UNIX) as probe:
+            probe.connect(path)
+
+
+def test_socket_path_replaces_a_stale_socket(tmp_path: Path):
+    path = str(tmp_path / "server.sock")
+    with socket.socket(socket.AF_UNIX) as crashed:
+        crashed.bind(path)
+    server = unix_server()
+    server.start(0, socket_path=path)
+    try:
+        # the old socket goes right away, the new one is bound by the server thread
+        deadline = time.time() + 5
+        while not Path(path).exists():
+            assert time.time() < deadline, "server did not bind"
+            time.sleep(0.01)
+        assert stat.S_ISSOCK(Path(path).stat().st_mode)
+        with socket.socket(socket.AF_UNIX) as probe:
+            probe.connect(path)
+    finally:
+        server.end()
@@ -0,0 +1,77 @@
+from pathlib import Path
+from queue import Queue
+
+import bpy
+from numpy import array, float32, int32
+
+from blender_server import command
+from software_client import (
+    Client,
+    RunCommands,
+    SyncMesh,
+    SyncXform,
+    create_mesh,
+    set_xform,
+)
+
+from conftest import connected, sync_soon
+
+translation = array((1, 2, 3), float32)
+rotation = array((1, 0, 0, 0), float32)
+scale = array((1, 1, 1), float32)
+positions = array(((0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)), float32)
+triangles = array(((0, 1, 2), (0, 2, 3)), int32)
+
+
+def test_deleted_object_does_not_stop_syncs(server: int):
+    frames = Queue[int]()
+
+    def on_matrices(matrices, paths, shared):
+        frames.put(len(matrices))
+
+    client = Client(lambda data: commands.run(data), [], [])
+    commands = RunCommands([SyncXform(matrices_callback=on_matrices)], client)
+    client.start(server, host="127.0.0.1")
+    try:
+        connected(client)
+        for name in ("a", "b"):
+            set_xform(
+                client, translation, rotation, scale, Path(name), Path("f"), True
+            ).result(10)
+        sync_soon()
+        assert frames.get(timeout=10) == 2
+
+        (active,) = command.sessions.values()
+        deleted = active.xforms[(Path("b"), Path("f"))].obj_name
+        bpy.data.objects.remove(bpy.data.objects[deleted])
+        sync_soon()
+        assert frames.get(timeout=10) == 2
+
+        set_xform(
+            client, translation, rotation, scale, Path("c"), Path("f"), True
+        ).result(10)
+        sync_soon()
+        assert frames.get(timeout=10) == 3
+    finally:
+        client.end()
+
+
+def test_positions_update_turns_sync_on(server: int):
+    frames = Queue[Path]()
+
+    def on_mesh(positions, indices, path, file_path, shared):
+        frames.put(path)
+
+    client = Client(lambda data: commands.run(data), [], [])
+    commands = RunCommands([SyncMesh(on_mesh)], client)
+    client.start(server, host="127.0.0.1")
+    try:
+        connected(client)
+        path, file_path = Path("a"), Path("f")
+        create_mesh(client, positions, triangles, path, file_path, False).result(10)
+        # same topology, only the positions and the sync flag travel
+        create_mesh(client, positions + 1, triangles, path, file_path, True).result(10)
+        sync_soon()
+        assert frames.get(timeout=10) == path
+    finally:
+        client.end()